@@ -1,21 +1,76 @@
+import asyncio
 import os
-from fastapi_users import FastAPIUsers, BaseUserManager, IntegerIDMixin
+import time
+from concurrent.futures import ThreadPoolExecutor
+import jwt
+from fastapi_users import FastAPIUsers, BaseUserManager, IntegerIDMixin, exceptions
 from fastapi_users.authentication import CookieTransport, AuthenticationBackend, JWTStrategy
 from fastapi_users_db_sqlalchemy import SQLAlchemyUserDatabase
 from models import User
-from database import get_async_db
+from database import async_session, get_async_db
+from user_cache import user_cache
 from fastapi import Depends
 
 # Use the secret key from Heroku config vars, with a fallback for local testing
 SECRET = os.environ.get("SECRET_KEY", "fallback-secret-for-local-only")
+# bcrypt is slow on purpose, so hashing runs on these threads instead of blocking the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 4))
 
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+async def run_in_password_pool(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(password_executor, fn, *args)
+
+# Same flows as BaseUserManager, but every bcrypt call goes through run_in_password_pool
 class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
     reset_password_token_secret = SECRET
     verification_token_secret = SECRET
 
+    async def create(self, user_create, safe: bool = False, request=None) -> User:
+        await self.validate_password(user_create.password, user_create)
+        user_dict = user_create.create_update_dict() if safe else user_create.create_update_dict_superuser()
+        # Hashed before the lookup, whose transaction (and pooled connection) would otherwise
+        # stay open, blocking other writers, for as long as bcrypt runs
+        user_dict["hashed_password"] = await run_in_password_pool(self.password_helper.hash, user_dict.pop("password"))
+        if await self.user_db.get_by_email(user_create.email) is not None:
+            raise exceptions.UserAlreadyExists()
+        user = await self.user_db.create(user_dict)
+        await self.on_after_register(user, request)
+        return user
+
+    async def authenticate(self, credentials):
+        try:
+            user = await self.get_by_email(credentials.username)
+        except exceptions.UserNotExists:
+            # Hash anyway so unknown emails take as long as wrong passwords
+            await run_in_password_pool(self.password_helper.hash, credentials.password)
+            return None
+        verified, updated_password_hash = await run_in_password_pool(
+            self.password_helper.verify_and_update, credentials.password, user.hashed_password
+        )
+        if not verified:
+            return None
+        if updated_password_hash is not None:
+            await self.user_db.update(user, {"hashed_password": updated_password_hash})
+        return user
+
+    async def _update(self, user: User, update_dict: dict) -> User:
+        update_dict = dict(update_dict)
+        if "password" in update_dict:
+            password = update_dict.pop("password")
+            await self.validate_password(password, user)
+            update_dict["hashed_password"] = await run_in_password_pool(self.password_helper.hash, password)
+        user = await super()._update(user, update_dict)
+        # Covers profile updates, password resets and verification
+        user_cache.invalidate(user.id)
+        return user
+
     async def on_after_register(self, user: User, request=None):
         print(f"User {user.username} has registered.")
 
+    async def on_after_delete(self, user: User, request=None):
+        user_cache.invalidate(user.id)
+
 async def get_user_db(db=Depends(get_async_db)):
     yield SQLAlchemyUserDatabase(db, User)
 
@@ -24,8 +79,23 @@ async def get_user_manager(user_db=Depends(get_user_db)):
 
 cookie_transport = CookieTransport(cookie_max_age=3600)
 
+# Serves repeat reads of a token from user_cache; a miss decodes the JWT and loads the user
+class CachedJWTStrategy(JWTStrategy):
+    async def read_token(self, token, user_manager):
+        if token is None:
+            return None
+        user = user_cache.get(token)
+        if user is not None:
+            return user
+        user = await super().read_token(token, user_manager)
+        if user is not None:
+            # Already verified by super(); only the expiry is needed so the entry can't outlive the token
+            expires_at = jwt.decode(token, options={"verify_signature": False}).get("exp")
+            user_cache.put(token, user, expires_in=expires_at - time.time() if expires_at else None)
+        return user
+
 def get_jwt_strategy() -> JWTStrategy:
-    return JWTStrategy(secret=SECRET, lifetime_seconds=3600)
+    return CachedJWTStrategy(secret=SECRET, lifetime_seconds=3600)
 
 auth_backend = AuthenticationBackend(
     name="jwt",
@@ -38,4 +108,13 @@ fastapi_users = FastAPIUsers[User, int](
     [auth_backend],
 )
 
-current_active_user = fastapi_users.current_user(active=True)
\ No newline at end of file
+current_active_user = fastapi_users.current_user(active=True)
+
+# WebSocket routes cannot use current_active_user (it expects an HTTP request), so they
+# resolve the auth cookie themselves
+async def user_from_cookie(token: str):
+    if not token:
+        return None
+    async with async_session() as db:
+        user = await get_jwt_strategy().read_token(token, UserManager(SQLAlchemyUserDatabase(db, User)))
+    return user if user and user.is_active else None
\ No newline at end of file
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import re
+import time
+import httpx
+
+from benchmarks.harness import AppHarness
+
+# p50/p99 latency of signed-in story reads while registrations run on the same worker, with
+# bcrypt inline on the event loop and no user cache, versus the thread pool and user cache.
+#   python -m benchmarks.auth_bench
+READERS = int(os.environ.get("BENCH_READERS", 8))
+REGISTRATIONS = int(os.environ.get("BENCH_REGISTRATIONS", 20))
+
+async def inline(fn, *args):
+    return fn(*args)
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+async def measure(app, story_url: str, cookies, mode: str) -> list:
+    latencies, done = [], asyncio.Event()
+
+    async def reader():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="https://bench", cookies=cookies) as client:
+            while not done.is_set():
+                started = time.perf_counter()
+                response = await client.get(story_url)
+                assert response.status_code == 200, response.status_code
+                latencies.append(time.perf_counter() - started)
+
+    async def register(n: int):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="https://bench") as client:
+            response = await client.post("/auth/register", data={"username": f"{mode}{n}", "email": f"{mode}{n}@example.com", "password": "correct horse"})
+            assert response.status_code == 303, response.text[:200]
+
+    readers = [asyncio.create_task(reader()) for _ in range(READERS)]
+    await asyncio.sleep(0.2)
+    await asyncio.gather(*(register(n) for n in range(REGISTRATIONS)))
+    done.set()
+    await asyncio.gather(*readers)
+    return latencies
+
+async def main():
+    async with AppHarness() as harness:
+        import auth
+        from user_cache import user_cache
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=harness.app), base_url="https://bench") as client:
+            await client.post("/auth/register", data={"username": "reader", "email": "reader@example.com", "password": "correct horse"})
+            response = await client.post("/auth/jwt/login", data={"username": "reader@example.com", "password": "correct horse"})
+            assert response.status_code == 204, response.text
+            page = await client.post("/generate", data={"genre": "fantasy", "prompt": ""})
+            token = re.search(r'name="starter_token" value="([^"]+)"', page.text).group(1)
+            story_url = (await client.post("/start", data={"starter": 0, "starter_token": token})).headers["location"]
+            cookies = client.cookies
+
+        offloaded, ttl = auth.run_in_password_pool, user_cache.ttl
+        auth.run_in_password_pool, user_cache.ttl = inline, 0
+        user_cache.invalidate(1)
+        baseline = await measure(harness.app, story_url, cookies, "inline")
+        auth.run_in_password_pool, user_cache.ttl = offloaded, ttl
+        current = await measure(harness.app, story_url, cookies, "pooled")
+
+        print(f"{READERS} readers, {REGISTRATIONS} concurrent registrations")
+        for name, latencies in (("inline bcrypt, no cache", baseline), ("bcrypt pool, user cache", current)):
+            print(f"{name:24} reads {len(latencies):5}  p50 {percentile(latencies, 0.5):7.1f} ms  p99 {percentile(latencies, 0.99):7.1f} ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
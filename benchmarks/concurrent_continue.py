@@ -0,0 +1,92 @@
+import asyncio
+import os
+import re
+import sys
+from sqlalchemy import select, func
+
+from benchmarks.harness import AppHarness
+
+# Concurrency check for continuations: N simultaneous clicks on the same choice must cause
+# exactly one Gemini generation and one new part, whether they post the form or stream the
+# continuation (every stream then gets the story's paragraphs and ends with "done"). A last
+# round simulates two workers racing (separate single-flight registries): both may generate,
+# but only one part is saved.
+# Exits non-zero on failure.
+#   python -m benchmarks.concurrent_continue
+CLICKS = int(os.environ.get("BENCH_CLICKS", 20))
+
+async def part_count(story_id: int) -> int:
+    from database import async_session
+    from models import StoryPart
+    async with async_session() as db:
+        return (await db.execute(select(func.count(StoryPart.id)).where(StoryPart.story_id == story_id))).scalar()
+
+async def part_of(choice_id: int) -> int:
+    from database import async_session
+    from models import ChoiceOption
+    async with async_session() as db:
+        return (await db.get(ChoiceOption, choice_id)).story_part_id
+
+async def main() -> int:
+    os.environ.setdefault("FAKE_GEMINI_LATENCY", "0.2")
+    failed = False
+    async with AppHarness() as harness:
+        import main as app_module
+        from singleflight import SingleFlight
+        from story_generator import generator
+        user = await harness.create_user("clicker")
+        async with harness.client_for(user) as client:
+            page = await client.post("/generate", data={"genre": "fantasy", "prompt": ""})
+            token = re.search(r'name="starter_token" value="([^"]+)"', page.text).group(1)
+            story_url = (await client.post("/start", data={"starter": 0, "starter_token": token})).headers["location"]
+            story_id = int(story_url.rsplit("/", 1)[1])
+            choice_ids = [int(choice_id) for choice_id in re.findall(r"/continue/\d+/(\d+)", (await client.get(story_url)).text)]
+            # The page view prefetches every choice; wait for that so only the clicks are counted
+            await asyncio.sleep(float(os.environ["FAKE_GEMINI_LATENCY"]) * 3 + 0.5)
+
+            before_parts = await part_count(story_id)
+            # Continuation calls only; saving a part also queues a summary call
+            calls_before = generator.usage["continuation"]["calls"]
+            app_module.generation_queue._prefetched.clear()
+            responses = await asyncio.gather(*(client.post(f"/continue/{story_id}/{choice_ids[1]}") for _ in range(CLICKS)))
+            generations, new_parts = generator.usage["continuation"]["calls"] - calls_before, await part_count(story_id) - before_parts
+            print(f"{CLICKS} simultaneous clicks: {generations} generation(s), {new_parts} new part(s)")
+            failed |= generations != 1 or new_parts != 1 or any(response.status_code != 303 for response in responses)
+
+            # The same through the streaming endpoint, on a choice of the new part
+            choice = int(re.findall(r"/continue/\d+/(\d+)", (await client.get(story_url)).text)[0])
+            await asyncio.sleep(float(os.environ["FAKE_GEMINI_LATENCY"]) * 3 + 0.5)
+            before_parts = await part_count(story_id)
+            calls_before = generator.usage["continuation"]["calls"]
+            app_module.generation_queue._prefetched.clear()
+            responses = await asyncio.gather(*(client.post(f"/continue/{story_id}/{choice}/stream") for _ in range(CLICKS)))
+            generations, new_parts = generator.usage["continuation"]["calls"] - calls_before, await part_count(story_id) - before_parts
+            events = [re.findall(r"^event: (\w+)", response.text, re.M) for response in responses]
+            print(f"{CLICKS} simultaneous streams: {generations} generation(s), {new_parts} new part(s),"
+                  f" {sum(e.count('paragraph') for e in events)} paragraphs sent")
+            failed |= generations != 1 or new_parts != 1
+            failed |= any(response.status_code != 200 or e[-1:] != ["done"] or "paragraph" not in e for response, e in zip(responses, events))
+
+            # Two workers: each has its own single-flight registry and generation queue dedup
+            page = await client.get(story_url)
+            next_choice = int(re.findall(r"/continue/\d+/(\d+)", page.text)[0])
+            next_part = await part_of(next_choice)
+            before_parts = await part_count(story_id)
+            app_module.generation_queue._prefetched.clear()
+            workers = [SingleFlight(), SingleFlight()]
+
+            async def click(registry):
+                app_module.continuations = registry
+                await app_module.continue_choice(user.id, story_id, next_part, next_choice, "Choice", "fantasy")
+
+            await asyncio.gather(*(click(workers[n % 2]) for n in range(CLICKS)))
+            new_parts = await part_count(story_id) - before_parts
+            print(f"{CLICKS} clicks across 2 workers: {new_parts} new part(s)")
+            failed |= new_parts != 1
+
+    if failed:
+        print("FAIL: duplicate generations or parts")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
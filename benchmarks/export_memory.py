@@ -0,0 +1,92 @@
+import asyncio
+import gc
+import io
+import json
+import sys
+import tracemalloc
+import zipfile
+
+from benchmarks.harness import AppHarness
+from benchmarks.seed import seed_user, seed_story
+
+# Peak Python memory while exporting, as story length and story count grow. Exports are
+# consumed chunk by chunk and thrown away, the way a StreamingResponse sends them; a peak
+# that grows with the input means something is buffering. Also checks each format parses.
+# Exits non-zero on failure.
+#   python -m benchmarks.export_memory
+LENGTHS = [400, 1600, 6400]
+COUNTS = [20, 80, 320]
+STORY_LENGTH_FOR_COUNTS = 5
+# Allowed growth of the peak between the two largest inputs (4x apart). The smallest input
+# fits in one cursor batch, so it is only reported. Zip-based formats may also add up to
+# ZIP_ENTRY_BYTES per file for the zip's central directory.
+MAX_GROWTH = 1.25
+ZIP_ENTRY_BYTES = 1024
+# Each query leaves a little cyclic garbage that waits for the older GC generations, which run
+# rarely; collecting every so many chunks keeps the peak a measure of what the export holds on to
+COLLECT_EVERY = 100
+
+async def peak_memory(chunks) -> int:
+    gc.collect()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    count = 0
+    async for chunk in chunks:
+        count += 1
+        if count % COLLECT_EVERY == 0:
+            gc.collect()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+async def collect(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+async def main() -> int:
+    async with AppHarness() as harness:
+        from database import async_session
+        from export import export_story, export_user_stories, STORY_FORMATS, EPUB_PARTS_PER_CHAPTER
+        from sqlalchemy import select
+        from models import Story
+        async with async_session() as db:
+            reader = await seed_user(db, "reader")
+            stories = {length: await seed_story(db, reader.id, length) for length in LENGTHS}
+            archivists = {}
+            for count in COUNTS:
+                archivists[count] = await seed_user(db, f"archivist{count}")
+                for _ in range(count):
+                    await seed_story(db, archivists[count].id, STORY_LENGTH_FOR_COUNTS)
+            await db.commit()
+            rows = {length: (await db.execute(select(Story.id, Story.user_id, Story.title, Story.genre, Story.head_part_id).where(Story.id == story.id))).first() for length, story in stories.items()}
+
+        failed = False
+        # Every format must produce something its readers accept
+        story = rows[LENGTHS[0]]
+        parts = json.loads(await collect(export_story(story, "json")))["parts"]
+        assert len(parts) == LENGTHS[0] and parts[1]["chosen"] == "Choice 0.0", parts[:2]
+        book = zipfile.ZipFile(io.BytesIO(await collect(export_story(story, "epub"))))
+        assert book.namelist()[0] == "mimetype" and book.testzip() is None and "OEBPS/content.opf" in book.namelist()
+        assert (await collect(export_story(story, "md"))).count(b"\n> ") == LENGTHS[0] - 1
+        lines = (await collect(export_user_stories(archivists[COUNTS[0]].id, "ndjson"))).splitlines()
+        assert len(lines) == COUNTS[0] * (STORY_LENGTH_FOR_COUNTS + 1) and all(json.loads(line) for line in lines)
+        archive = zipfile.ZipFile(io.BytesIO(await collect(export_user_stories(archivists[COUNTS[0]].id, "zip"))))
+        assert len(archive.namelist()) == COUNTS[0] and archive.testzip() is None
+
+        def report(label, peaks, zip_entries=lambda key: 0):
+            nonlocal failed
+            print(f"{label:<22}" + "".join(f"{key:>8}: {peak / 1024:7.1f} KiB" for key, peak in peaks.items()))
+            (middle, before), (largest, after) = list(peaks.items())[-2:]
+            if after > before * MAX_GROWTH + (zip_entries(largest) - zip_entries(middle)) * ZIP_ENTRY_BYTES:
+                print(f"FAIL: {label} peak memory grows with its input")
+                failed = True
+
+        for format in STORY_FORMATS:
+            chapters = (lambda parts: parts // EPUB_PARTS_PER_CHAPTER + 1) if format == "epub" else (lambda parts: 0)
+            report(f"story {format} (parts)", {length: await peak_memory(export_story(row, format)) for length, row in rows.items()}, chapters)
+        for format in ("ndjson", "zip"):
+            files = (lambda count: count) if format == "zip" else (lambda count: 0)
+            report(f"bulk {format} (stories)", {count: await peak_memory(export_user_stories(user.id, format)) for count, user in archivists.items()}, files)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+import random
+from starlette.applications import Starlette
+from starlette.requests import Request, ClientDisconnect
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+import uvicorn
+
+# Stand-in for the Gemini REST API so the generator can be exercised without network access.
+# Point the app at it with GEMINI_URL=http://127.0.0.1:8765/v1beta/models/fake:generateContent
+LATENCY = float(os.environ.get("FAKE_GEMINI_LATENCY", 0.2))
+JITTER = float(os.environ.get("FAKE_GEMINI_JITTER", 0.0))
+# Delay between chunks of a streamGenerateContent response; LATENCY is the time to first chunk
+CHUNK_DELAY = float(os.environ.get("FAKE_GEMINI_CHUNK_DELAY", 0.05))
+
+# Fault injection, also adjustable at runtime by changing the dict: a share of calls fail at
+# once with error_status, and a share are delayed by a further spike_latency seconds
+faults = {
+    "error_rate": float(os.environ.get("FAKE_GEMINI_ERROR_RATE", 0.0)),
+    "error_status": int(os.environ.get("FAKE_GEMINI_ERROR_STATUS", 503)),
+    "spike_rate": float(os.environ.get("FAKE_GEMINI_SPIKE_RATE", 0.0)),
+    "spike_latency": float(os.environ.get("FAKE_GEMINI_SPIKE_LATENCY", 5.0)),
+}
+
+STORY = (
+    "The lantern flickered as the traveler reached the edge of the old forest.\n"
+    "Somewhere ahead, a bell rang once and fell silent.\n"
+    "She steps onto the overgrown path toward the sound.\n"
+    "She climbs the nearest tree to look for a safer route.\n"
+    "She waits at the treeline until the bell rings again."
+)
+
+# peak_active: the most calls in progress at once
+stats = {"calls": 0, "connections": set(), "active": 0, "peak_active": 0, "errors": 0, "spikes": 0}
+
+def reset_stats():
+    stats["calls"] = 0
+    stats["errors"] = 0
+    stats["spikes"] = 0
+    stats["connections"] = set()
+    stats["peak_active"] = stats["active"]
+
+async def model_action(request: Request):
+    stats["calls"] += 1
+    if request.client:
+        stats["connections"].add((request.client.host, request.client.port))
+    try:
+        body = await request.json()
+    except ClientDisconnect:
+        # A hedged or timed-out request the client gave up on
+        return Response(status_code=499)
+    prompt = "".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+    usage = {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(STORY) // 4}
+    if random.random() < faults["error_rate"]:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"code": faults["error_status"], "message": "Injected failure"}}, status_code=faults["error_status"])
+    stats["active"] += 1
+    stats["peak_active"] = max(stats["peak_active"], stats["active"])
+    streaming = False
+    try:
+        latency = max(0.0, LATENCY + random.uniform(-JITTER, JITTER))
+        if random.random() < faults["spike_rate"]:
+            stats["spikes"] += 1
+            latency += faults["spike_latency"]
+        await asyncio.sleep(latency)
+        if request.path_params["action"].endswith(":streamGenerateContent"):
+            streaming = True
+            return StreamingResponse(stream_chunks(usage), media_type="text/event-stream")
+        # A blocking call returns only once the whole text would have been generated
+        await asyncio.sleep(CHUNK_DELAY * STORY.count("\n"))
+        return JSONResponse({"candidates": [{"content": {"parts": [{"text": STORY}]}}], "usageMetadata": usage})
+    finally:
+        # A streamed call stays active until its last chunk
+        if not streaming:
+            stats["active"] -= 1
+
+async def stream_chunks(usage: dict):
+    lines = STORY.split("\n")
+    try:
+        for i, line in enumerate(lines):
+            if i:
+                await asyncio.sleep(CHUNK_DELAY)
+            chunk = line + ("\n" if i < len(lines) - 1 else "")
+            yield f"data: {json.dumps({'candidates': [{'content': {'parts': [{'text': chunk}]}}], 'usageMetadata': usage})}\r\n\r\n"
+    finally:
+        stats["active"] -= 1
+
+async def get_stats(request: Request):
+    return JSONResponse({"calls": stats["calls"], "connections": len(stats["connections"]), "peak_active": stats["peak_active"],
+                         "errors": stats["errors"], "spikes": stats["spikes"]})
+
+app = Starlette(routes=[
+    Route("/v1beta/models/{action:path}", model_action, methods=["POST"]),
+    Route("/stats", get_stats),
+])
+
+def make_server(host: str = "127.0.0.1", port: int = 8765) -> uvicorn.Server:
+    return uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+
+if __name__ == "__main__":
+    make_server(port=int(os.getenv("PORT", 8765))).run()
@@ -0,0 +1,48 @@
+import asyncio
+import os
+import time
+import httpx
+
+from benchmarks import fake_gemini
+from story_generator import StoryGenerator, build_prompt
+
+# Compares the old one-client-per-call, sequential starter generation with the shared
+# pooled client fanning the three starters out concurrently.
+#   python -m benchmarks.generator_bench
+PORT = int(os.environ.get("FAKE_GEMINI_PORT", 8765))
+URL = f"http://127.0.0.1:{PORT}/v1beta/models/fake:generateContent"
+ROUNDS = int(os.environ.get("BENCH_ROUNDS", 10))
+
+async def unpooled_starters():
+    for _ in range(3):
+        async with httpx.AsyncClient() as client:
+            response = await client.post(URL, params={"key": "bench"}, json={"contents": [{"parts": [{"text": build_prompt()}]}]})
+            response.raise_for_status()
+
+async def measure(label, starters):
+    fake_gemini.reset_stats()
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        await starters()
+    elapsed = (time.perf_counter() - started) / ROUNDS
+    print(f"{label:<28} {elapsed * 1000:8.1f} ms/generate  {len(fake_gemini.stats['connections']):4d} connections")
+
+async def main():
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    server = fake_gemini.make_server(port=PORT)
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    pooled = StoryGenerator(url=URL)
+    await pooled.start()
+    try:
+        await measure("per-call client, sequential", unpooled_starters)
+        await measure("pooled client, fan-out", lambda: pooled.generate_many([("", "fantasy", False)] * 3))
+    finally:
+        await pooled.close()
+        server.should_exit = True
+        await serve_task
+
+if __name__ == "__main__":
+    asyncio.run(main())
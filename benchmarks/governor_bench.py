@@ -0,0 +1,91 @@
+import asyncio
+import os
+import sys
+import time
+import httpx
+from fastapi import Request
+
+os.environ.setdefault("FAKE_GEMINI_LATENCY", "0.5")
+from benchmarks import fake_gemini
+from benchmarks.harness import AppHarness
+
+# Drives the generation governor through the app and the fake Gemini server, with small limits
+# so every case is reached quickly:
+#   spike     more simultaneous requests than slots plus queue: the excess gets a fast 429 and
+#             Gemini never sees more calls at once than there are slots
+#   deadline  queued requests give up with a 429 once the queue deadline passes
+#   user      one user past their burst is refused while another user still gets through
+#   global    the global bucket caps all users together
+# Exits non-zero on failure.
+#   python -m benchmarks.governor_bench
+# Rejections must not wait on Gemini; this allows for a slow CI machine
+FAST_REJECT_SECONDS = 0.25
+
+async def timed_post(client: httpx.AsyncClient, user_name: str, headers: dict = None):
+    started = time.perf_counter()
+    response = await client.post("/sessions/new", data={"genre": "fantasy", "prompt": ""}, headers={"x-bench-user": user_name, **(headers or {})})
+    return response, time.perf_counter() - started
+
+def summarize(label: str, results: list) -> dict:
+    accepted = [elapsed for response, elapsed in results if response.status_code == 303]
+    rejected = [elapsed for response, elapsed in results if response.status_code == 429]
+    print(f"{label:<10} {len(accepted):3} accepted, {len(rejected):3} rejected"
+          + (f", slowest rejection {max(rejected) * 1000:.0f} ms" if rejected else "")
+          + f", Gemini peak concurrency {fake_gemini.stats['peak_active']}")
+    return {"accepted": len(accepted), "rejected": len(rejected), "slowest_rejection": max(rejected, default=0.0),
+            "other": [response.status_code for response, _ in results if response.status_code not in (303, 429)]}
+
+async def main() -> int:
+    failed = False
+
+    def check(condition: bool, message: str):
+        nonlocal failed
+        if not condition:
+            print(f"FAIL: {message}")
+            failed = True
+
+    async with AppHarness() as harness:
+        import main as app_module
+        from auth import current_active_user
+        from governor import GenerationGovernor
+        users = {f"user{n}": await harness.create_user(f"user{n}") for n in range(12)}
+        # Each request picks its user with a header, so many users can share one client
+        def bench_user(request: Request):
+            return users[request.headers["x-bench-user"]]
+        harness.app.dependency_overrides[current_active_user] = bench_user
+        generous = {"user_per_minute": 600, "user_burst": 100, "global_per_minute": 6000, "global_burst": 1000}
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=harness.app), base_url="https://bench") as client:
+            app_module.governor = GenerationGovernor(max_concurrent=2, max_queue=2, queue_timeout=10, **generous)
+            fake_gemini.reset_stats()
+            spike = summarize("spike", await asyncio.gather(*(timed_post(client, name) for name in users)))
+            check(spike["accepted"] == 4 and spike["rejected"] == len(users) - 4 and not spike["other"], "spike should admit 2 running + 2 queued")
+            check(spike["slowest_rejection"] < FAST_REJECT_SECONDS, "spike rejections should be immediate")
+            check(fake_gemini.stats["peak_active"] <= 2, "Gemini saw more concurrent calls than slots")
+
+            app_module.governor = GenerationGovernor(max_concurrent=1, max_queue=4, queue_timeout=0.2, **generous)
+            fake_gemini.reset_stats()
+            deadline = summarize("deadline", await asyncio.gather(*(timed_post(client, name) for name in list(users)[:5])))
+            check(deadline["accepted"] == 1 and deadline["rejected"] == 4, "queued requests should time out")
+            check(deadline["slowest_rejection"] < 0.2 + FAST_REJECT_SECONDS, "queue deadline not honoured")
+
+            app_module.governor = GenerationGovernor(user_per_minute=6, user_burst=3, global_per_minute=6000, global_burst=1000)
+            fake_gemini.reset_stats()
+            greedy = [await timed_post(client, "user0") for _ in range(5)]
+            user = summarize("user", greedy + [await timed_post(client, "user1")])
+            check(user["accepted"] == 4 and all(response.status_code == 429 for response, _ in greedy[3:]), "user burst not enforced per user")
+            # 6 per minute is a token every 10 s, less whatever has refilled since
+            check(1 <= int(greedy[-1][0].headers.get("retry-after", 0)) <= 10, "Retry-After should be when the next token arrives")
+
+            app_module.governor = GenerationGovernor(user_per_minute=600, user_burst=100, global_per_minute=6, global_burst=4)
+            fake_gemini.reset_stats()
+            overall = summarize("global", [await timed_post(client, name) for name in list(users)[:6]])
+            check(overall["accepted"] == 4 and overall["rejected"] == 2, "global burst not enforced")
+
+            response, _ = await timed_post(client, "user9", headers={"accept": "text/html"})
+            check(response.status_code == 429 and "try again" in response.text, "browsers should get the try-again page")
+            check(app_module.governor.stats["rejected_global_quota"] == 3, "rejections not counted")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
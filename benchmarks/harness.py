@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import os
+import tempfile
+import httpx
+from sqlalchemy import event
+
+from benchmarks import fake_gemini
+
+# Runs the real FastAPI app in-process against a throwaway SQLite database and the fake
+# Gemini server. The environment is set before main is imported, so import it through here.
+class AppHarness:
+    def __init__(self, database_url: str = None, gemini_port: int = int(os.environ.get("FAKE_GEMINI_PORT", 8765))):
+        if database_url is None:
+            handle, path = tempfile.mkstemp(suffix=".db")
+            os.close(handle)
+            database_url = f"sqlite+aiosqlite:///{path}"
+        os.environ["DATABASE_URL"] = database_url
+        os.environ.setdefault("GEMINI_API_KEY", "bench")
+        os.environ["GEMINI_URL"] = f"http://127.0.0.1:{gemini_port}/v1beta/models/fake:generateContent"
+        os.environ.pop("GEMINI_STREAM_URL", None)
+        self.gemini_port = gemini_port
+        self.server = None
+        self.app = None
+
+    async def __aenter__(self):
+        self.server = fake_gemini.make_server(port=self.gemini_port)
+        self._serve_task = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            await asyncio.sleep(0.01)
+
+        import main
+        from database import async_engine
+        async_engine.echo = False
+        # Enforce foreign keys as Postgres does; SQLite leaves them off unless asked
+        event.listen(async_engine.sync_engine, "connect", lambda connection, _: connection.cursor().execute("PRAGMA foreign_keys=ON"))
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        from models import Base
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        for handler in main.app.router.on_startup:
+            await handler()
+        self.app = main.app
+        self.engine = async_engine
+        return self
+
+    async def __aexit__(self, *exc):
+        for handler in self.app.router.on_shutdown:
+            await handler()
+        await self.engine.dispose()
+        self.server.should_exit = True
+        await self._serve_task
+
+    # An HTTP client for the app, signed in as `user` by overriding the auth dependency
+    def client_for(self, user) -> httpx.AsyncClient:
+        from auth import current_active_user
+        self.app.dependency_overrides[current_active_user] = lambda: user
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app), base_url="https://bench")
+
+    async def create_user(self, name: str):
+        from database import async_session
+        from models import User
+        async with async_session() as db:
+            user = User(username=name, email=f"{name}@example.com", hashed_password="x", is_active=True)
+            db.add(user)
+            await db.commit()
+            return user
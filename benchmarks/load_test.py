@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+import httpx
+
+# Scripted user journeys against the real app (SQLite or a local Postgres) and the fake
+# Gemini server, at a fixed concurrency. Reports throughput, p50/p95/p99 per route, SQL
+# statements per request and Gemini calls per journey; --output writes the report as JSON
+# and --baseline compares against an earlier report.
+#   python -m benchmarks.load_test --concurrency 8 --journeys 40 --continues 5 --output after.json
+#   python -m benchmarks.load_test --database-url postgresql+asyncpg://localhost/storypath_bench
+#
+# Story journey: register, log in, generate starters, start, (view, continue) x N, end.
+# Session journey: two players register and log in, one creates a session, the other joins,
+# then they take turns viewing and continuing it N times.
+
+class JourneyFailed(Exception):
+    pass
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, client: httpx.AsyncClient, method: str, route: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        name = f"{method} {route}"
+        self.latencies[name].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[name] += 1
+            raise JourneyFailed(f"{name}: {response.status_code}")
+        return response
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def new_client(app) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="https://bench")
+
+async def sign_up_and_in(client: httpx.AsyncClient, recorder: Recorder, name: str):
+    credentials = {"username": name, "email": f"{name}@example.com", "password": "correct horse"}
+    await recorder.request(client, "POST", "/auth/register", "/auth/register", data=credentials)
+    await recorder.request(client, "POST", "/auth/jwt/login", "/auth/jwt/login", data={"username": credentials["email"], "password": credentials["password"]})
+
+async def story_journey(app, recorder: Recorder, name: str, continues: int):
+    async with new_client(app) as client:
+        await sign_up_and_in(client, recorder, name)
+        page = await recorder.request(client, "POST", "/generate", "/generate", data={"genre": "mystery", "prompt": "a locked lighthouse"})
+        token = re.search(r'name="starter_token" value="([^"]+)"', page.text).group(1)
+        response = await recorder.request(client, "POST", "/start", "/start", data={"starter": 0, "starter_token": token})
+        story_id = response.headers["location"].rsplit("/", 1)[1]
+        for _ in range(continues):
+            page = await recorder.request(client, "GET", "/story/{story_id}", f"/story/{story_id}")
+            choice_url = re.findall(r"/continue/\d+/\d+", page.text)[0]
+            await recorder.request(client, "POST", "/continue/{story_id}/{choice_id}", choice_url)
+        await recorder.request(client, "POST", "/end/{story_id}", f"/end/{story_id}")
+
+async def session_journey(app, recorder: Recorder, name: str, continues: int):
+    async with new_client(app) as host, new_client(app) as guest:
+        await sign_up_and_in(host, recorder, f"{name}a")
+        await sign_up_and_in(guest, recorder, f"{name}b")
+        response = await recorder.request(host, "POST", "/sessions/new", "/sessions/new", data={"genre": "sci-fi", "prompt": ""})
+        session_url = response.headers["location"]
+        await recorder.request(guest, "POST", "/session/{session_id}/join", f"{session_url}/join")
+        for turn in range(continues):
+            player = (host, guest)[turn % 2]
+            page = await recorder.request(player, "GET", "/session/{session_id}", session_url)
+            choice_url = re.findall(r"/session/\d+/\d+", page.text)[0]
+            await recorder.request(player, "POST", "/session/{session_id}/{choice_id}", choice_url)
+
+def request_queries() -> dict:
+    from metrics import REQUEST_QUERIES
+    totals = defaultdict(dict)
+    for metric in REQUEST_QUERIES.collect():
+        for sample in metric.samples:
+            if sample.name.endswith(("_sum", "_count")):
+                totals[f"{sample.labels['method']} {sample.labels['route']}"][sample.name.rsplit("_", 1)[1]] = sample.value
+    return {route: values["sum"] / values["count"] for route, values in totals.items() if values.get("count")}
+
+async def run(args) -> dict:
+    from benchmarks import fake_gemini
+    from benchmarks.harness import AppHarness
+    async with AppHarness(database_url=args.database_url) as harness:
+        from story_generator import generator
+        recorder = Recorder()
+        names = (f"user{n}" for n in itertools.count())
+        kinds = ["session" if args.session_every and n % args.session_every == args.session_every - 1 else "story" for n in range(args.journeys)]
+        completed, failed = defaultdict(int), []
+        pending = iter(kinds)
+        fake_gemini.reset_stats()
+
+        async def virtual_user():
+            for kind in pending:
+                journey = session_journey if kind == "session" else story_journey
+                try:
+                    await journey(harness.app, recorder, next(names), args.continues)
+                    completed[kind] += 1
+                except Exception as e:
+                    failed.append(f"{kind}: {e}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(virtual_user() for _ in range(args.concurrency)))
+        duration = time.perf_counter() - started
+        gemini_calls = fake_gemini.stats["calls"]
+        queries = request_queries()
+
+    journeys = sum(completed.values())
+    requests = sum(len(values) for values in recorder.latencies.values())
+    ms = lambda seconds: round(seconds * 1000, 1)
+    return {
+        "config": {
+            "database": "postgres" if args.database_url and args.database_url.startswith("postgres") else "sqlite",
+            "concurrency": args.concurrency, "journeys": args.journeys, "continues": args.continues,
+            "session_every": args.session_every, "gemini_latency": fake_gemini.LATENCY, "gemini_jitter": fake_gemini.JITTER,
+        },
+        "duration_s": round(duration, 2),
+        "journeys": {**completed, "failed": len(failed)},
+        "failures": failed[:20],
+        "throughput": {"journeys_per_s": round(journeys / duration, 2), "requests_per_s": round(requests / duration, 2)},
+        "routes": {
+            route: {
+                "count": len(values),
+                "errors": recorder.errors.get(route, 0),
+                "p50_ms": ms(percentile(values, 0.50)),
+                "p95_ms": ms(percentile(values, 0.95)),
+                "p99_ms": ms(percentile(values, 0.99)),
+                "db_queries_per_request": round(queries.get(route, 0.0), 2),
+            }
+            for route, values in sorted(recorder.latencies.items())
+        },
+        "gemini": {
+            "calls": gemini_calls,
+            "calls_per_journey": round(gemini_calls / journeys, 2) if journeys else None,
+            "by_kind": {kind: usage["calls"] for kind, usage in generator.usage.items()},
+        },
+    }
+
+def print_report(report: dict, baseline: dict = None):
+    counts = report["journeys"]
+    print(f"{counts.get('story', 0) + counts.get('session', 0)} journeys ({counts.get('story', 0)} story, {counts.get('session', 0)} session, "
+          f"{counts['failed']} failed) in {report['duration_s']} s: {report['throughput']['journeys_per_s']} journeys/s, "
+          f"{report['throughput']['requests_per_s']} requests/s, {report['gemini']['calls_per_journey']} Gemini calls/journey")
+    print(f"{'route':40} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}" + (f" {'p99 vs base':>12}" if baseline else ""))
+    for route, stats in report["routes"].items():
+        line = f"{route:40} {stats['count']:6} {stats['p50_ms']:8} {stats['p95_ms']:8} {stats['p99_ms']:8} {stats['db_queries_per_request']:8}"
+        before = (baseline or {}).get("routes", {}).get(route)
+        if before:
+            line += f" {stats['p99_ms'] - before['p99_ms']:+11.1f}"
+        print(line)
+    for failure in report["failures"]:
+        print(f"FAILED {failure}")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load-test StoryPath against a fake Gemini backend")
+    parser.add_argument("--concurrency", type=int, default=8, help="virtual users running journeys at once")
+    parser.add_argument("--journeys", type=int, default=32, help="journeys to run in total")
+    parser.add_argument("--continues", type=int, default=5, help="continuations per journey")
+    parser.add_argument("--session-every", type=int, default=4, help="every Nth journey is a multiplayer session (0 for none)")
+    parser.add_argument("--database-url", default=None, help="e.g. postgresql+asyncpg://localhost/bench (default: a temporary SQLite file)")
+    parser.add_argument("--gemini-latency", type=float, default=None, help="seconds the fake Gemini takes per call")
+    parser.add_argument("--gemini-jitter", type=float, default=None, help="random +/- seconds on that latency")
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    parser.add_argument("--baseline", help="an earlier --output report to compare p99 latencies with")
+    args = parser.parse_args()
+    # fake_gemini reads these at import
+    if args.gemini_latency is not None:
+        os.environ["FAKE_GEMINI_LATENCY"] = str(args.gemini_latency)
+    if args.gemini_jitter is not None:
+        os.environ["FAKE_GEMINI_JITTER"] = str(args.gemini_jitter)
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 1 if report["journeys"]["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
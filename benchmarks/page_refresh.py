@@ -0,0 +1,98 @@
+import asyncio
+import os
+import sys
+import time
+from sqlalchemy import update
+
+from benchmarks.harness import AppHarness
+from benchmarks.seed import seed_story, QueryCounter
+
+# Bytes served, CPU time and SQL statements per refresh of the story and session pages for
+# long stories, three ways: a plain reload, a reload accepting gzip, and a conditional reload
+# (If-None-Match) of a page that has not changed. Also checks that the ETag changes once the
+# story or the session's participants do. Bytes are response body bytes; CPU is the whole
+# process's, the in-process client included. Exits non-zero on failure.
+#   python -m benchmarks.page_refresh
+LENGTHS = [50, 200]
+REFRESHES = int(os.environ.get("BENCH_REFRESHES", 50))
+# Words per part, about what Gemini writes for one part
+PART_WORDS = 150
+FILLER = " ".join(["the lantern flickered as the traveler walked on"] * (PART_WORDS // 8))
+
+async def refresh(client, url: str, headers: dict, counter: QueryCounter) -> dict:
+    counter.count = 0
+    started = time.process_time()
+    sent = 0
+    for _ in range(REFRESHES):
+        response = await client.get(url, headers=headers)
+        sent += response.num_bytes_downloaded
+    return {
+        "status": response.status_code,
+        "bytes": sent / REFRESHES,
+        "cpu_ms": (time.process_time() - started) / REFRESHES * 1000,
+        "queries": counter.count / REFRESHES,
+        "response": response,
+    }
+
+async def main() -> int:
+    failed = False
+
+    def check(condition: bool, message: str):
+        nonlocal failed
+        if not condition:
+            print(f"FAIL: {message}")
+            failed = True
+
+    async with AppHarness() as harness:
+        from database import async_session
+        from models import StoryPart, Session, SessionParticipant
+        user = await harness.create_user("reader")
+        guest = await harness.create_user("guest")
+        async with async_session() as db:
+            stories = {length: await seed_story(db, user.id, length) for length in LENGTHS}
+            for story in stories.values():
+                await db.execute(update(StoryPart).where(StoryPart.story_id == story.id).values(text=StoryPart.text + " " + FILLER))
+            sessions = {}
+            for length, story in stories.items():
+                sessions[length] = Session(story_id=story.id, participants=[SessionParticipant(user_id=user.id)])
+                db.add(sessions[length])
+            await db.commit()
+        counter = QueryCounter(harness.engine)
+
+        print(f"{'page':<22} {'reload':>20} {'gzip':>20} {'304':>20}   (bytes, CPU ms, queries per refresh)")
+        async with harness.client_for(user) as client:
+            for length in LENGTHS:
+                for label, url in ((f"story {length} parts", f"/story/{stories[length].id}"), (f"session {length} parts", f"/session/{sessions[length].id}")):
+                    # Once first, so the transcript is materialized and the choices prefetched
+                    await client.get(url)
+                    plain = await refresh(client, url, {"accept-encoding": "identity"}, counter)
+                    gzipped = await refresh(client, url, {"accept-encoding": "gzip"}, counter)
+                    etag = plain["response"].headers.get("etag")
+                    conditional = await refresh(client, url, {"accept-encoding": "gzip", "if-none-match": etag or ""}, counter)
+                    print(f"{label:<22}" + "".join(f" {r['bytes']:8.0f} {r['cpu_ms']:6.2f} {r['queries']:4.1f}" for r in (plain, gzipped, conditional)))
+                    check(etag is not None and plain["status"] == 200, f"{label}: no ETag")
+                    check(gzipped["response"].headers.get("content-encoding") == "gzip", f"{label}: not compressed")
+                    check(gzipped["bytes"] < plain["bytes"] / 3, f"{label}: gzip should cut the page to under a third")
+                    check(conditional["status"] == 304 and conditional["bytes"] < 300, f"{label}: unchanged page should be a bodiless 304")
+                    check(conditional["queries"] == 1, f"{label}: a 304 should cost one version query")
+                    check(conditional["cpu_ms"] < plain["cpu_ms"], f"{label}: a 304 should cost less CPU than a render")
+
+            export = await client.get(f"/story/{stories[LENGTHS[0]].id}/export", params={"format": "json"}, headers={"accept-encoding": "gzip"})
+            check(export.status_code == 200 and "content-encoding" not in export.headers, "downloads should not be compressed")
+
+            # A new part or a new participant must change the ETag
+            story, session = stories[LENGTHS[0]], sessions[LENGTHS[0]]
+            story_etag = (await client.get(f"/story/{story.id}")).headers["etag"]
+            await client.post(f"/end/{story.id}")
+            check((await client.get(f"/story/{story.id}", headers={"if-none-match": story_etag})).status_code == 200, "story ETag did not change with a new part")
+            session_etag = (await client.get(f"/session/{session.id}")).headers["etag"]
+        async with harness.client_for(guest) as guest_client:
+            check((await guest_client.get(f"/session/{session.id}", headers={"if-none-match": session_etag})).status_code == 200, "another reader got the first reader's ETag")
+            await guest_client.post(f"/session/{session.id}/join")
+        async with harness.client_for(user) as client:
+            response = await client.get(f"/session/{session.id}", headers={"if-none-match": session_etag})
+            check(response.status_code == 200 and response.headers["etag"] != session_etag, "session ETag did not change when someone joined")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
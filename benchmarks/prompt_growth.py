@@ -0,0 +1,81 @@
+import asyncio
+import os
+import re
+import sys
+from sqlalchemy import select
+
+# Read by fake_gemini at import
+os.environ.setdefault("FAKE_GEMINI_LATENCY", "0")
+os.environ.setdefault("FAKE_GEMINI_CHUNK_DELAY", "0")
+# Read by the governor at import; one author writes every part, far past the default user
+# and global quotas
+GENERATIONS = str(int(os.environ.get("BENCH_PARTS", 100)) + 10)
+os.environ.setdefault("GOVERNOR_USER_BURST", GENERATIONS)
+os.environ.setdefault("GOVERNOR_GLOBAL_BURST", GENERATIONS)
+
+from benchmarks.harness import AppHarness
+
+# Prompt tokens per continuation call as a story grows to 100 parts, next to what sending
+# the whole transcript would cost. Exits non-zero if prompts grow past the context budget.
+#   python -m benchmarks.prompt_growth
+PARTS = int(os.environ.get("BENCH_PARTS", 100))
+# Instructions and the chosen option on top of the story context
+PROMPT_OVERHEAD_TOKENS = 300
+
+async def open_choice(story_id: int) -> int:
+    from database import async_session
+    from models import StoryPart, ChoiceOption
+    async with async_session() as db:
+        return (await db.execute(
+            select(ChoiceOption.id)
+            .join(StoryPart, ChoiceOption.story_part_id == StoryPart.id)
+            .where(StoryPart.story_id == story_id, ChoiceOption.next_part_id.is_(None))
+            .order_by(ChoiceOption.id.desc())
+            .limit(1)
+        )).scalar_one()
+
+async def transcript_tokens(story_id: int) -> int:
+    from database import async_session
+    from transcript import get_transcript
+    async with async_session() as db:
+        return len((await get_transcript(db, story_id))["story"]) // 4
+
+async def main() -> int:
+    async with AppHarness() as harness:
+        from story_generator import generator
+        from jobs import generation_queue
+        from story_context import PROMPT_CONTEXT_TOKENS
+        user = await harness.create_user("author")
+        rows = []
+        async with harness.client_for(user) as client:
+            page = await client.post("/generate", data={"genre": "mystery", "prompt": "a locked lighthouse"})
+            token = re.search(r'name="starter_token" value="([^"]+)"', page.text).group(1)
+            story_url = (await client.post("/start", data={"starter": 0, "starter_token": token})).headers["location"]
+            story_id = int(story_url.rsplit("/", 1)[1])
+            for part in range(1, PARTS + 1):
+                naive = await transcript_tokens(story_id)
+                response = await client.post(f"/continue/{story_id}/{await open_choice(story_id)}")
+                assert response.status_code == 303, response.text[:200]
+                rows.append((part, naive, generator.usage["continuation"]["last_prompt_tokens"]))
+                # Let the summary catch up, except now and then, when the next prompt must cover the gap itself
+                while part % 7 and ("summary", story_id) in generation_queue._inflight:
+                    await asyncio.sleep(0.01)
+            await client.post(f"/end/{story_id}")
+            ending = generator.usage["continuation"]["last_prompt_tokens"]
+
+        print(f"{'part':>5} {'full transcript':>16} {'summary + latest':>17}")
+        for part, naive, sent in rows:
+            if part in (1, 2, 10, 25, 50, 75, 100) or part == PARTS:
+                print(f"{part:5} {naive:16} {sent:17}")
+        usage = generator.usage
+        print(f"ending prompt {ending} tokens; {usage['summary']['calls']} summary calls, "
+              f"{usage['summary']['max_prompt_tokens']} max summary prompt tokens")
+        limit = PROMPT_CONTEXT_TOKENS + PROMPT_OVERHEAD_TOKENS
+        largest = max(usage["continuation"]["max_prompt_tokens"], usage["summary"]["max_prompt_tokens"])
+        if largest > limit:
+            print(f"FAIL: a prompt used {largest} tokens, over the {limit} token budget")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import sys
+import time
+from sqlalchemy import text
+
+from benchmarks.seed import make_engine, seed_user, seed_story
+
+# Query plans and latencies of the hot lookups with and without the indexes added in
+# migrations 0002 and 0005. Uses SQLite by default; pass a database URL to run against Postgres.
+#   python -m benchmarks.query_plans [postgresql+asyncpg://...]
+STORIES = int(os.environ.get("BENCH_STORIES", 500))
+PARTS = int(os.environ.get("BENCH_PARTS", 20))
+REPEAT = int(os.environ.get("BENCH_REPEAT", 200))
+
+INDEXES = [
+    ("ix_stories_user_id", "stories", "user_id"),
+    ("ix_story_parts_story_id", "story_parts", "story_id"),
+    ("ix_story_parts_previous_part_id", "story_parts", "previous_part_id"),
+    ("ix_choice_options_story_part_id", "choice_options", "story_part_id"),
+    ("ix_choice_options_next_part_id", "choice_options", "next_part_id"),
+    ("ix_sessions_story_id", "sessions", "story_id"),
+    ("ix_session_participants_user_id", "session_participants", "user_id"),
+    ("ix_session_participants_session_user", "session_participants", "session_id, user_id"),
+]
+
+# The path from a part up to the first one, as story_tree.path_cte builds it
+PATH = ("WITH RECURSIVE story_path(id, previous_part_id, depth) AS ("
+        "SELECT id, previous_part_id, 0 FROM story_parts WHERE id = :part_id UNION ALL "
+        "SELECT p.id, p.previous_part_id, story_path.depth + 1 FROM story_parts p JOIN story_path ON p.id = story_path.previous_part_id) ")
+
+QUERIES = {
+    "active path": PATH + "SELECT story_parts.id, story_parts.text, choice_options.text FROM story_parts "
+                   "JOIN story_path ON story_path.id = story_parts.id "
+                   "LEFT JOIN choice_options ON choice_options.next_part_id = story_parts.id ORDER BY story_path.depth DESC",
+    "path choices": PATH + "SELECT * FROM choice_options WHERE story_part_id IN (SELECT id FROM story_path)",
+    "branch tip": "WITH RECURSIVE branch(id) AS (SELECT id FROM story_parts WHERE id = :first_part_id UNION ALL "
+                  "SELECT p.id FROM story_parts p JOIN branch ON p.previous_part_id = branch.id) SELECT MAX(id) FROM branch",
+    "open choices": "SELECT * FROM choice_options WHERE story_part_id = :part_id",
+    "choice leading to part": "SELECT * FROM choice_options WHERE next_part_id = :part_id",
+    "membership check": "SELECT * FROM session_participants WHERE session_id = :session_id AND user_id = :user_id",
+}
+
+async def seed(session_factory):
+    from models import Session, SessionParticipant
+    async with session_factory() as db:
+        users = [await seed_user(db, f"reader{n}") for n in range(20)]
+        for n in range(STORIES):
+            story = await seed_story(db, users[n % len(users)].id, PARTS)
+            session = Session(story_id=story.id, participants=[SessionParticipant(user_id=user.id) for user in users[:5]])
+            db.add(session)
+        await db.commit()
+        return story.id, session.id, users[0].id
+
+async def run_queries(engine, params):
+    explain = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    async with engine.connect() as conn:
+        for name, sql in QUERIES.items():
+            plan = (await conn.execute(text(explain + sql), params)).all()
+            started = time.perf_counter()
+            for _ in range(REPEAT):
+                (await conn.execute(text(sql), params)).all()
+            elapsed = (time.perf_counter() - started) / REPEAT * 1e6
+            print(f"  {name:<24} {elapsed:9.1f} us   {' | '.join(str(row[-1]) for row in plan)}")
+
+async def main(url: str = None):
+    engine, session_factory = await make_engine(url)
+    story_id, session_id, user_id = await seed(session_factory)
+    async with engine.connect() as conn:
+        first_part_id, part_id = (await conn.execute(text("SELECT MIN(id), MAX(id) FROM story_parts WHERE story_id = :story_id"), {"story_id": story_id})).one()
+    params = {"story_id": story_id, "part_id": part_id, "first_part_id": first_part_id, "session_id": session_id, "user_id": user_id}
+    print(f"{STORIES} stories x {PARTS} parts, {REPEAT} runs per query")
+
+    print("with indexes")
+    await run_queries(engine, params)
+    async with engine.begin() as conn:
+        for name, _, _ in INDEXES:
+            await conn.execute(text(f"DROP INDEX {name}"))
+    # Fresh connections, so no statement prepared against the old schema is reused
+    await engine.dispose()
+    print("without indexes")
+    await run_queries(engine, params)
+    await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else None))
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("FAKE_GEMINI_LATENCY", "0.05")
+os.environ.setdefault("FAKE_GEMINI_JITTER", "0.02")
+os.environ.setdefault("FAKE_GEMINI_CHUNK_DELAY", "0")
+from benchmarks import fake_gemini
+from benchmarks.harness import AppHarness
+
+# Drives the Gemini resilience layer against the fake server with injected latency spikes
+# and errors:
+#   hedging   p99 with and without hedged requests while 4% of calls stall
+#   errors    share of calls that succeed with and without retries while 20% of calls fail
+#   deadline  a call whose every attempt stalls gives up at its total deadline
+#   queueing  calls waiting for one of the worker's own connections are not Gemini timeouts:
+#             a healthy Gemini behind a small pool neither trips the breaker nor skews hedging
+#   breaker   during an outage the breaker opens and calls fail fast without reaching
+#             Gemini; after the cooldown one probe is let through and closes it again
+#   stream    streamed continuations retry failures that happen before the first chunk, and
+#             a stream whose first chunk never comes gives up at its deadline
+#   app       with the breaker open, browsers get the try-again page with a 503 at once
+# Exits non-zero on failure.
+#   python -m benchmarks.resilience_bench
+CALLS = int(os.environ.get("BENCH_CALLS", 300))
+CONCURRENCY = 8
+# Short-circuited calls must not wait on Gemini; this allows for a slow CI machine
+FAST_FAIL_SECONDS = 0.05
+
+def make_generator(breaker=None, hedge_max_ratio: float = 0.2, max_concurrency: int = 32, **settings):
+    from resilience import Resilience, CallPolicy, CircuitBreaker
+    from story_generator import StoryGenerator
+    policy = CallPolicy(**{"attempt_timeout": 2, "total_timeout": 5, "retries": 2, "backoff": 0.01, "hedge_percentile": 90, **settings})
+    resilience = Resilience({"story": policy, "continuation": policy}, breaker or CircuitBreaker(min_calls=10, cooldown=0.5), hedge_max_ratio)
+    return StoryGenerator(url=os.environ["GEMINI_URL"], max_concurrency=max_concurrency, resilience=resilience)
+
+# (succeeded, seconds, error) per call
+async def timed_calls(generator, count: int, concurrency: int = CONCURRENCY) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await generator.generate()
+            except Exception as e:
+                return False, time.perf_counter() - started, e
+            return True, time.perf_counter() - started, None
+    return await asyncio.gather(*(one() for _ in range(count)))
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+def set_faults(**faults):
+    fake_gemini.faults.update({"error_rate": 0.0, "spike_rate": 0.0, "spike_latency": 5.0, **faults})
+
+async def main() -> int:
+    from resilience import GeminiUnavailable, CircuitBreaker
+    failed = False
+
+    def check(condition: bool, message: str):
+        nonlocal failed
+        if not condition:
+            print(f"FAIL: {message}")
+            failed = True
+
+    async with AppHarness() as harness:
+        generators = []
+
+        def generator_with(**settings):
+            generators.append(make_generator(**settings))
+            return generators[-1]
+
+        try:
+            # hedging
+            p99 = {}
+            for label, hedge_percentile in (("unhedged", 0), ("hedged", 90)):
+                generator = generator_with(hedge_percentile=hedge_percentile)
+                set_faults()
+                await timed_calls(generator, 40)
+                set_faults(spike_rate=0.04, spike_latency=1.5)
+                fake_gemini.reset_stats()
+                results = await timed_calls(generator, CALLS)
+                stats = generator.resilience.stats
+                p99[label] = percentile([seconds for _, seconds, _ in results], 99)
+                print(f"hedging   {label:<9} p50 {percentile([s for _, s, _ in results], 50) * 1000:6.0f} ms  p99 {p99[label] * 1000:6.0f} ms"
+                      f"  {fake_gemini.stats['calls']} Gemini calls for {CALLS}, {stats['hedges']} hedges, {stats['hedge_wins']} won")
+                check(all(ok for ok, _, _ in results), f"{label} calls failed")
+                check(stats["hedges"] <= generator.resilience.hedge_max_ratio * stats["calls"], "hedges over budget")
+            check(p99["hedged"] < p99["unhedged"] / 2, "hedging should cut the p99 at least in half")
+
+            # errors; a lenient breaker, since at a 20% error rate a window of 20 can reach the default 50%
+            success = {}
+            for label, retries in (("no retry", 0), ("retried", 3)):
+                generator = generator_with(retries=retries, hedge_percentile=0, breaker=CircuitBreaker(failure_rate=0.9))
+                set_faults(error_rate=0.2)
+                fake_gemini.reset_stats()
+                results = await timed_calls(generator, CALLS)
+                success[label] = sum(ok for ok, _, _ in results) / len(results)
+                print(f"errors    {label:<9} {success[label]:6.1%} succeeded, {fake_gemini.stats['errors']} injected errors,"
+                      f" {generator.resilience.stats['retries']} retries")
+                check(all(ok or isinstance(error, GeminiUnavailable) for ok, _, error in results), "exhausted retries should raise GeminiUnavailable")
+            check(success["retried"] >= 0.98, "retries should recover nearly every call")
+
+            # deadline
+            generator = generator_with(attempt_timeout=0.3, total_timeout=1.0, retries=5, hedge_percentile=0)
+            set_faults(spike_rate=1.0)
+            [(ok, seconds, error)] = await timed_calls(generator, 1)
+            print(f"deadline  gave up after {seconds * 1000:.0f} ms ({getattr(error, 'reason', error)}),"
+                  f" {generator.resilience.stats['attempt_timeouts']} attempts timed out")
+            check(not ok and isinstance(error, GeminiUnavailable), "a call past its deadline should raise GeminiUnavailable")
+            check(0.9 <= seconds < 1.0 + FAST_FAIL_SECONDS * 6, "total deadline not honoured")
+
+            # queueing: 20 calls through 2 connections wait far longer than an attempt may take
+            generator = generator_with(attempt_timeout=0.2, max_concurrency=2)
+            set_faults()
+            results = await timed_calls(generator, 20, concurrency=20)
+            stats = generator.resilience.stats
+            print(f"queueing  {sum(ok for ok, _, _ in results)}/20 calls succeeded, slowest {max(s for _, s, _ in results) * 1000:.0f} ms,"
+                  f" {stats['attempt_timeouts']} attempts timed out, breaker {generator.resilience.breaker.state}")
+            check(all(ok for ok, _, _ in results), "calls waiting for a connection should not fail")
+            check(stats["attempt_timeouts"] == 0 and generator.resilience.breaker.state == "closed", "waiting for a connection should not count against Gemini")
+
+            # breaker
+            generator = generator_with(hedge_percentile=0)
+            breaker = generator.resilience.breaker
+            set_faults(error_rate=1.0)
+            fake_gemini.reset_stats()
+            for _ in range(10):
+                await timed_calls(generator, 1)
+            calls_when_open = fake_gemini.stats["calls"]
+            results = await timed_calls(generator, 20)
+            print(f"breaker   opened after {calls_when_open} Gemini calls; slowest short-circuited call"
+                  f" {max(s for _, s, _ in results) * 1000:.1f} ms")
+            check(breaker.state == "open", "breaker should open during an outage")
+            check(calls_when_open <= breaker.min_calls + 2, "breaker opened too late")
+            check(fake_gemini.stats["calls"] == calls_when_open, "calls reached Gemini while the breaker was open")
+            check(all(getattr(error, "reason", None) == "circuit_open" for _, _, error in results), "open breaker should short-circuit")
+            check(max(s for _, s, _ in results) < FAST_FAIL_SECONDS, "short-circuited calls should fail fast")
+            await asyncio.sleep(breaker.cooldown)
+            await timed_calls(generator, 5, concurrency=5)
+            check(fake_gemini.stats["calls"] == calls_when_open + 1, "a half-open breaker should let exactly one probe through")
+            check(breaker.state == "open", "a failed probe should reopen the breaker")
+            set_faults()
+            await asyncio.sleep(breaker.cooldown)
+            results = await timed_calls(generator, 5, concurrency=1)
+            print(f"breaker   after recovery {sum(ok for ok, _, _ in results)}/5 calls succeeded, breaker {breaker.state}")
+            check(all(ok for ok, _, _ in results) and breaker.state == "closed", "a successful probe should close the breaker")
+
+            # stream
+            generator = generator_with(retries=5, breaker=CircuitBreaker(failure_rate=0.9))
+            set_faults(error_rate=0.3)
+            fake_gemini.reset_stats()
+            complete = 0
+            for _ in range(20):
+                text = "".join([chunk async for chunk in generator.stream(is_continuation=True)])
+                complete += text == fake_gemini.STORY
+            print(f"stream    {complete}/20 streams complete, {fake_gemini.stats['errors']} injected errors,"
+                  f" {generator.resilience.stats['retries']} retries")
+            check(complete == 20, "streams should retry failures before the first chunk")
+
+            # stream deadline: the wait for the first chunk is bounded like any other attempt
+            generator = generator_with(attempt_timeout=0.3, total_timeout=1.0, retries=5)
+            set_faults(spike_rate=1.0)
+            started = time.perf_counter()
+            try:
+                [chunk async for chunk in generator.stream(is_continuation=True)]
+                error = None
+            except Exception as e:
+                error = e
+            seconds = time.perf_counter() - started
+            print(f"stream    stalled stream gave up after {seconds * 1000:.0f} ms ({getattr(error, 'reason', error)}),"
+                  f" {generator.resilience.stats['attempt_timeouts']} attempts timed out")
+            check(isinstance(error, GeminiUnavailable), "a stalled stream should raise GeminiUnavailable")
+            check(0.9 <= seconds < 1.0 + FAST_FAIL_SECONDS * 6, "stream total deadline not honoured")
+
+            # app
+            set_faults()
+            import main as app_module
+            user = await harness.create_user("reader")
+            breaker = app_module.generator.resilience.breaker
+            for _ in range(breaker.min_calls):
+                breaker.record(False)
+            fake_gemini.reset_stats()
+            async with harness.client_for(user) as client:
+                started = time.perf_counter()
+                page = await client.post("/sessions/new", data={"genre": "fantasy", "prompt": ""}, headers={"accept": "text/html"})
+                elapsed = time.perf_counter() - started
+                api = await client.post("/sessions/new", data={"genre": "fantasy", "prompt": ""})
+            print(f"app       {page.status_code} in {elapsed * 1000:.0f} ms, Retry-After {page.headers.get('retry-after')}")
+            check(page.status_code == 503 and "try again" in page.text and page.headers.get("retry-after"), "browsers should get the try-again page")
+            check(api.status_code == 503 and api.json()["reason"] == "circuit_open", "API clients should get a 503 with the reason")
+            check(fake_gemini.stats["calls"] == 0, "Gemini was called while the breaker was open")
+        finally:
+            set_faults()
+            for generator in generators:
+                await generator.close()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
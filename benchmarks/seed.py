@@ -0,0 +1,69 @@
+import os
+import tempfile
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from models import Base, User, Story, StoryPart, ChoiceOption
+
+# Helpers shared by the database benchmarks: a throwaway SQLite database and seeded stories.
+async def make_engine(url: str = None):
+    if url is None:
+        handle, path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        url = f"sqlite+aiosqlite:///{path}"
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+async def seed_user(db: AsyncSession, name: str = "reader") -> User:
+    user = User(username=name, email=f"{name}@example.com", hashed_password="x")
+    db.add(user)
+    await db.flush()
+    return user
+
+# A linear story of `length` parts, each with three choices of which the first was taken
+async def seed_story(db: AsyncSession, user_id: int, length: int, genre: str = "fantasy") -> Story:
+    story = Story(user_id=user_id, genre=genre, title=f"{genre.capitalize()} Tale: seeded {length}...")
+    db.add(story)
+    await db.flush()
+    previous = None
+    for n in range(length):
+        part = StoryPart(story_id=story.id, text=f"Part {n} of the seeded story.", previous_part_id=previous.id if previous else None)
+        db.add(part)
+        await db.flush()
+        if previous is not None:
+            previous_choices[0].next_part_id = part.id
+        previous_choices = [ChoiceOption(story_part_id=part.id, text=f"Choice {n}.{i}") for i in range(3)]
+        db.add_all(previous_choices)
+        previous = part
+    story.head_part_id = previous.id if previous else None
+    await db.flush()
+    return story
+
+# A story whose first `length` parts form the active path, with a side branch of
+# `branch_length` parts forking off the second choice of each of them
+async def seed_branched_story(db: AsyncSession, user_id: int, length: int, branch_length: int) -> Story:
+    story = await seed_story(db, user_id, length)
+    path = (await db.execute(select(StoryPart).where(StoryPart.story_id == story.id).order_by(StoryPart.id))).scalars().all()
+    for part in path:
+        fork = (await db.execute(select(ChoiceOption).where(ChoiceOption.story_part_id == part.id).order_by(ChoiceOption.id).offset(1).limit(1))).scalar_one()
+        previous = part
+        for n in range(branch_length):
+            branch_part = StoryPart(story_id=story.id, text=f"Branch part {n} after part {part.id}.", previous_part_id=previous.id)
+            db.add(branch_part)
+            await db.flush()
+            if n == 0:
+                fork.next_part_id = branch_part.id
+            db.add_all([ChoiceOption(story_part_id=branch_part.id, text=f"Branch choice {n}.{i}") for i in range(3)])
+            previous = branch_part
+    await db.flush()
+    return story
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
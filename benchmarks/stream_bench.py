@@ -0,0 +1,47 @@
+import asyncio
+import os
+import time
+
+from benchmarks import fake_gemini
+from story_generator import StoryGenerator, parse_story
+
+# Time to first text for a blocking generateContent call versus streamGenerateContent.
+#   python -m benchmarks.stream_bench
+PORT = int(os.environ.get("FAKE_GEMINI_PORT", 8765))
+URL = f"http://127.0.0.1:{PORT}/v1beta/models/fake:generateContent"
+ROUNDS = int(os.environ.get("BENCH_ROUNDS", 5))
+
+async def main():
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    server = fake_gemini.make_server(port=PORT)
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    client = StoryGenerator(url=URL)
+    await client.start()
+    try:
+        blocking, first_chunk, streamed = [], [], []
+        for _ in range(ROUNDS):
+            started = time.perf_counter()
+            await client.generate(is_continuation=True)
+            blocking.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            chunks = []
+            async for chunk in client.stream(is_continuation=True):
+                if not chunks:
+                    first_chunk.append(time.perf_counter() - started)
+                chunks.append(chunk)
+            streamed.append(time.perf_counter() - started)
+            assert len(parse_story("".join(chunks))["choices"]) == 3
+        mean = lambda values: sum(values) / len(values) * 1000
+        print(f"blocking  first text {mean(blocking):7.1f} ms  complete {mean(blocking):7.1f} ms")
+        print(f"streaming first text {mean(first_chunk):7.1f} ms  complete {mean(streamed):7.1f} ms")
+    finally:
+        await client.close()
+        server.should_exit = True
+        await serve_task
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+import asyncio
+import sys
+
+from benchmarks.seed import make_engine, seed_user, seed_story, seed_branched_story, QueryCounter
+from transcript import load_transcript, get_transcript
+from story_tree import path_choices
+
+# Regression check: rebuilding a transcript and reading the cached one must each cost the
+# same number of queries no matter how long the story is, and so must the branch selector's
+# choices however many branches the story has. Exits non-zero if any of them grows.
+#   python -m benchmarks.transcript_queries
+LENGTHS = [1, 10, 50, 200]
+# Active path length x parts per side branch; the largest story has about 4000 parts
+BRANCHED = [(10, 1), (50, 10), (200, 20)]
+
+async def main() -> int:
+    engine, session_factory = await make_engine()
+    async with session_factory() as db:
+        user = await seed_user(db)
+        stories = {length: await seed_story(db, user.id, length) for length in LENGTHS}
+        await db.commit()
+    # Materialize the transcripts up front so get_transcript is measured on its read path
+    for story in stories.values():
+        async with session_factory() as db:
+            await get_transcript(db, story.id)
+
+    counter = QueryCounter(engine)
+    failed = False
+    for loader in (load_transcript, get_transcript):
+        counts = {}
+        for length, story in stories.items():
+            async with session_factory() as db:
+                counter.count = 0
+                transcript = await loader(db, story.id)
+                counts[length] = counter.count
+                assert transcript["story"].count("class='chosen'") == length - 1
+            print(f"{loader.__name__:<16} {length:5d} parts: {counts[length]} queries")
+        if len(set(counts.values())) != 1:
+            print(f"FAIL: {loader.__name__} query count grows with story length")
+            failed = True
+
+    async with session_factory() as db:
+        branched = {shape: await seed_branched_story(db, user.id, *shape) for shape in BRANCHED}
+        await db.commit()
+    for name, measure in (("load_transcript", lambda db, story: load_transcript(db, story.id)), ("path_choices", lambda db, story: path_choices(db, story.head_part_id))):
+        counts = {}
+        for (length, branch_length), story in branched.items():
+            async with session_factory() as db:
+                counter.count = 0
+                result = await measure(db, story)
+                counts[length] = counter.count
+                if name == "load_transcript":
+                    assert result["story"].count("class='chosen'") == length - 1
+                else:
+                    assert len(result) == length
+            print(f"{name:<16} {length:5d} parts on the path, {length * (branch_length + 1):5d} in all: {counts[length]} queries")
+        if len(set(counts.values())) != 1:
+            print(f"FAIL: {name} query count grows with the number of branches")
+            failed = True
+    await engine.dispose()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
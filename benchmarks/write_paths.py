@@ -0,0 +1,83 @@
+import asyncio
+import re
+from contextvars import ContextVar
+from sqlalchemy import event, select
+
+from benchmarks.harness import AppHarness
+
+# Commits and SQL statements issued by each story-mutation endpoint. Background work the
+# endpoint queues (e.g. summary refreshes) runs on the queue's workers and isn't counted.
+#   python -m benchmarks.write_paths
+measuring = ContextVar("measuring", default=False)
+
+class WriteCounter:
+    def __init__(self, engine):
+        self.commits = 0
+        self.queries = 0
+        event.listen(engine.sync_engine, "commit", self._commit)
+        event.listen(engine.sync_engine, "before_cursor_execute", self._query)
+
+    def _commit(self, *args):
+        if measuring.get():
+            self.commits += 1
+
+    def _query(self, *args):
+        if measuring.get():
+            self.queries += 1
+
+    def reset(self):
+        self.commits = self.queries = 0
+
+async def open_choice_id(session_id: int) -> int:
+    from database import async_session
+    from models import Session, StoryPart, ChoiceOption
+    async with async_session() as db:
+        return (await db.execute(
+            select(ChoiceOption.id)
+            .join(StoryPart, ChoiceOption.story_part_id == StoryPart.id)
+            .join(Session, Session.story_id == StoryPart.story_id)
+            .where(Session.id == session_id, ChoiceOption.next_part_id.is_(None))
+            .limit(1)
+        )).scalar_one()
+
+async def main():
+    async with AppHarness() as harness:
+        measuring.set(True)
+        user = await harness.create_user("writer")
+        counter = WriteCounter(harness.engine)
+        results = {}
+        async with harness.client_for(user) as client:
+            async def measure(name, method, url, **kwargs):
+                counter.reset()
+                response = await client.request(method, url, **kwargs)
+                assert response.status_code in (200, 303), f"{name}: {response.status_code} {response.text[:200]}"
+                results[name] = (counter.commits, counter.queries)
+                return response
+
+            page = await client.post("/generate", data={"genre": "fantasy", "prompt": "a bell in the forest"})
+            token = re.search(r'name="starter_token" value="([^"]+)"', page.text).group(1)
+            response = await measure("POST /start", "POST", "/start", data={"starter": 0, "starter_token": token})
+            story_url = response.headers["location"]
+            choice_url = re.findall(r"/continue/\d+/\d+", (await client.get(story_url)).text)[0]
+            await measure("POST /continue", "POST", choice_url)
+            await measure("POST /end", "POST", story_url.replace("/story/", "/end/"))
+
+            # Branch the story: back to its first part, then on through another of its choices
+            story_id = int(story_url.rsplit("/", 1)[1])
+            first_part = int(re.search(r"/rewind/(\d+)", (await client.get(f"{story_url}/branches")).text).group(1))
+            await measure("POST /story/{id}/rewind", "POST", f"/story/{story_id}/rewind/{first_part}")
+            choice_url = re.findall(r"/continue/\d+/\d+", (await client.get(story_url)).text)[1]
+            await measure("POST /continue (branch)", "POST", choice_url)
+            await measure("POST /abandon (branched)", "POST", f"/abandon/{story_id}", data={"confirm": "true"})
+
+            response = await measure("POST /sessions/new", "POST", "/sessions/new", data={"genre": "mystery", "prompt": ""})
+            session_id = response.headers["location"].rsplit("/", 1)[1]
+            choice_id = await open_choice_id(int(session_id))
+            await measure("POST /session/{id}/{choice}", "POST", f"/session/{session_id}/{choice_id}")
+
+        print(f"{'endpoint':<30} {'commits':>7} {'queries':>7}")
+        for name, (commits, queries) in results.items():
+            print(f"{name:<30} {commits:>7} {queries:>7}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+import os
+import zlib
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compresses HTML and JSON responses: Brotli when the client accepts it and the brotli package
+# is installed, gzip otherwise. Everything else passes through untouched: event streams, so
+# server-sent events are never held back in a compressor's buffer, and downloads (anything sent
+# as an attachment, JSON exports included), which stream part by part.
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", 500))
+COMPRESSION_LEVEL = int(os.environ.get("COMPRESSION_LEVEL", 6))
+COMPRESSIBLE_TYPES = {"text/html", "application/json"}
+
+class GzipEncoder:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    # Flushes after every chunk so a streamed response is never held back
+    def compress(self, data: bytes, final: bool) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+class BrotliEncoder:
+    def __init__(self, level: int):
+        # Brotli's quality runs 0-11; its mid levels cost about what gzip's do
+        self._compressor = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        return self._compressor.process(data) + (self._compressor.finish() if final else self._compressor.flush())
+
+ENCODERS = {"gzip": GzipEncoder}
+if brotli is not None:
+    ENCODERS = {"br": BrotliEncoder, **ENCODERS}
+
+# The first of our encodings, in order of preference, that the Accept-Encoding header allows
+def choose_encoding(accept_encoding: str):
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        quality = next((param[2:] for param in params if param.startswith("q=")), "1")
+        try:
+            if float(quality) > 0:
+                accepted.add(name)
+        except ValueError:
+            pass
+    return next((name for name in ENCODERS if name in accepted or "*" in accepted), None)
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES, level: int = COMPRESSION_LEVEL):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope, receive, send):
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", "")) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        start, encoder = None, None
+
+        async def send_compressed(message):
+            nonlocal start, encoder
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether compressing is worth it
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                if self._compressible(headers):
+                    headers.add_vary_header("Accept-Encoding")
+                    if more_body or len(body) >= self.minimum_size:
+                        encoder = ENCODERS[encoding](self.level)
+                        headers["Content-Encoding"] = encoding
+                        del headers["Content-Length"]
+                if encoder is not None:
+                    body = encoder.compress(body, not more_body)
+                    if not more_body:
+                        headers["Content-Length"] = str(len(body))
+                await send(start)
+                start = None
+            elif encoder is not None:
+                body = encoder.compress(body, not more_body)
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+    def _compressible(self, headers: MutableHeaders) -> bool:
+        media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        attachment = headers.get("content-disposition", "").lower().startswith("attachment")
+        return media_type in COMPRESSIBLE_TYPES and "content-encoding" not in headers and not attachment
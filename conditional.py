@@ -0,0 +1,59 @@
+import hashlib
+import os
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Story, Session, SessionParticipant
+
+# Conditional GET for the story and session pages. A page is a function of a few ids, which
+# one small query reads: the story's head part (a part's choices are written with it, so the
+# head also pins the choices on offer), the session's participants, and the reader. Those
+# ids, and the templates, make the ETag; a request whose If-None-Match still matches gets a
+# 304 without loading the transcript or rendering anything.
+TEMPLATES_DIR = "templates"
+# Browsers keep the page but must check back with us every time
+PAGE_CACHE_CONTROL = "private, no-cache"
+
+def templates_version(directory: str = TEMPLATES_DIR) -> str:
+    digest = hashlib.sha1()
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name), "rb") as template:
+                digest.update(name.encode() + template.read())
+    return digest.hexdigest()
+
+# Changes with every deploy that changes a template, so old pages are not kept after one
+TEMPLATES_VERSION = templates_version()
+
+# Weak, since the same page is sent compressed or not
+def page_etag(*parts) -> str:
+    return 'W/"' + hashlib.sha1(repr((TEMPLATES_VERSION,) + parts).encode()).hexdigest()[:24] + '"'
+
+def is_fresh(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in tags)
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": PAGE_CACHE_CONTROL})
+
+def page_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": PAGE_CACHE_CONTROL}
+
+# (user_id, head_part_id, genre) of a story, or None
+async def story_version(db: AsyncSession, story_id: int):
+    return (await db.execute(select(Story.user_id, Story.head_part_id, Story.genre).where(Story.id == story_id))).one_or_none()
+
+# (session, head_part_id, genre, participant count, newest participant id) of a session, or None.
+# Participants only ever join, so the count and newest id change whenever the list does.
+async def session_version(db: AsyncSession, session_id: int):
+    def participants(aggregate):
+        return select(aggregate).where(SessionParticipant.session_id == Session.id).scalar_subquery()
+    return (await db.execute(
+        select(Session, Story.head_part_id, Story.genre, participants(func.count(SessionParticipant.id)), participants(func.max(SessionParticipant.id)))
+        .join(Story, Story.id == Session.story_id)
+        .where(Session.id == session_id)
+    )).one_or_none()
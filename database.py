@@ -1,5 +1,6 @@
 import os
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from metrics import instrument_engine
 
 # Get the database URL from Heroku environment variable
 DATABASE_URL = os.environ.get("DATABASE_URL")
@@ -8,8 +9,12 @@ DATABASE_URL = os.environ.get("DATABASE_URL")
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+asyncpg://", 1)
 
+# Logs every SQL statement; far too noisy for production, so only on when asked for
+SQL_ECHO = os.environ.get("SQL_ECHO", "").lower() in ("1", "true", "yes")
+
 # Create async engine
-async_engine = create_async_engine(DATABASE_URL, echo=True)
+async_engine = create_async_engine(DATABASE_URL, echo=SQL_ECHO)
+instrument_engine(async_engine)
 
 # Async session factory
 async_session = async_sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
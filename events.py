@@ -0,0 +1,108 @@
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# "memory" delivers events within this process only; "postgres" relays them through
+# LISTEN/NOTIFY so every uvicorn worker sharing the database sees them.
+EVENTS_BACKEND = os.environ.get("EVENTS_BACKEND", "memory")
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", 100))
+NOTIFY_CHANNEL = "storypath_events"
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_MAX_PAYLOAD = 7900
+
+class InMemoryBroker:
+    def __init__(self):
+        self._deliver = None
+
+    async def start(self, deliver):
+        self._deliver = deliver
+
+    async def stop(self):
+        self._deliver = None
+
+    async def publish(self, channel: str, message: dict):
+        if self._deliver is not None:
+            self._deliver(channel, message)
+
+class PostgresBroker:
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._connection = None
+        self._lock = asyncio.Lock()
+        self._deliver = None
+
+    async def start(self, deliver):
+        import asyncpg
+        self._deliver = deliver
+        self._connection = await asyncpg.connect(self.dsn)
+        await self._connection.add_listener(NOTIFY_CHANNEL, self._on_notify)
+
+    async def stop(self):
+        if self._connection is not None:
+            await self._connection.close()
+        self._connection = None
+
+    async def publish(self, channel: str, message: dict):
+        payload = json.dumps({"channel": channel, "message": message})
+        if len(payload.encode()) > NOTIFY_MAX_PAYLOAD:
+            # Too big to relay; tell subscribers to fetch a fresh snapshot instead
+            payload = json.dumps({"channel": channel, "message": {"type": "refresh"}})
+        async with self._lock:
+            await self._connection.execute("SELECT pg_notify($1, $2)", NOTIFY_CHANNEL, payload)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        event = json.loads(payload)
+        self._deliver(event["channel"], event["message"])
+
+# Fans published events out to every local subscriber of a channel. Each subscriber gets a
+# bounded queue; one that falls too far behind is sent a "refresh" and stops getting deltas.
+class EventHub:
+    def __init__(self, broker=None, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.broker = broker or InMemoryBroker()
+        self.queue_size = queue_size
+        self._subscribers = {}
+
+    async def start(self):
+        await self.broker.start(self._deliver)
+
+    async def stop(self):
+        await self.broker.stop()
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(channel, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, channel: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    async def publish(self, channel: str, message: dict):
+        try:
+            await self.broker.publish(channel, message)
+        except Exception as e:
+            # Live updates are best effort; the change itself is already committed
+            logger.error(f"Publishing to {channel} failed: {e}")
+
+    def _deliver(self, channel: str, message: dict):
+        for queue in list(self._subscribers.get(channel, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.unsubscribe(channel, queue)
+                queue.get_nowait()
+                queue.put_nowait({"type": "refresh"})
+
+def make_broker():
+    if EVENTS_BACKEND == "postgres":
+        from database import DATABASE_URL
+        return PostgresBroker(DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1))
+    return InMemoryBroker()
+
+event_hub = EventHub(make_broker())
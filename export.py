@@ -0,0 +1,182 @@
+import html
+import json
+import os
+import re
+import zipfile
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import async_session
+from models import Story
+from story_tree import path_parts_query
+
+# Story downloads of each story's active path (first part to head). Parts are read through a
+# server-side cursor and written out as they arrive, so memory stays flat however long the
+# story is or however many are exported.
+# Each export uses one session of its own, since the request's is closed once the response starts.
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 200))
+# Parts per EPUB chapter file; keeps the book's manifest small for very long stories
+EPUB_PARTS_PER_CHAPTER = 50
+STORIES_PAGE_SIZE = 50
+
+STORY_FORMATS = {
+    "txt": ("text/plain; charset=utf-8", "txt"),
+    "md": ("text/markdown; charset=utf-8", "md"),
+    "json": ("application/json", "json"),
+    "epub": ("application/epub+zip", "epub"),
+}
+BULK_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "zip": ("application/zip", "zip"),
+}
+
+# (part id, part text, text of the choice that led to it) from the first part to the head
+async def story_parts(db: AsyncSession, story):
+    rows = await db.stream(path_parts_query(story.head_part_id).execution_options(yield_per=EXPORT_BATCH_SIZE))
+    async for row in rows:
+        yield row
+
+# A user's stories in id order, a page at a time
+async def user_stories(db: AsyncSession, user_id: int):
+    last_id = 0
+    while True:
+        page = (await db.execute(
+            select(Story.id, Story.title, Story.genre, Story.head_part_id)
+            .where(Story.user_id == user_id, Story.id > last_id)
+            .order_by(Story.id)
+            .limit(STORIES_PAGE_SIZE)
+        )).all()
+        for story in page:
+            yield story
+        if len(page) < STORIES_PAGE_SIZE:
+            return
+        last_id = page[-1].id
+
+def export_filename(story, extension: str) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "-", story.title.lower()).strip("-")[:40] or "story"
+    return f"{story.id}-{slug}.{extension}"
+
+async def export_text(db: AsyncSession, story, markdown: bool = False):
+    yield f"# {story.title}\n" if markdown else f"{story.title}\n{'=' * len(story.title)}\n"
+    async for _, text, chosen in story_parts(db, story):
+        if chosen:
+            yield f"\n> {chosen}\n" if markdown else f"\n>> {chosen}\n"
+        yield f"\n{text}\n"
+
+async def export_json(db: AsyncSession, story):
+    # The story's fields, with the closing brace left off so the parts can follow
+    yield json.dumps({"id": story.id, "title": story.title, "genre": story.genre})[:-1] + ', "parts": ['
+    separator = ""
+    async for part_id, text, chosen in story_parts(db, story):
+        yield separator + json.dumps({"id": part_id, "chosen": chosen, "text": text})
+        separator = ", "
+    yield "]}\n"
+
+async def export_story(story, format: str):
+    async with async_session() as db:
+        if format == "epub":
+            async for chunk in export_epub(db, story):
+                yield chunk
+            return
+        chunks = export_json(db, story) if format == "json" else export_text(db, story, markdown=format == "md")
+        async for chunk in chunks:
+            yield chunk.encode()
+
+# zipfile writes here; the bytes are handed to the response after every write instead of
+# accumulating. Having no seek() makes zipfile use data descriptors, which needs no rewinding.
+# The one thing a zip has to keep is its central directory: a small record per file.
+class ZipStream:
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+    def __bool__(self):
+        return bool(self._chunks)
+
+EPUB_CONTAINER = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+def epub_chapter_start(story, number: int) -> str:
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml"><head>'
+            f"<title>{html.escape(story.title)} ({number})</title></head><body>"
+            + (f"<h1>{html.escape(story.title)}</h1>" if number == 1 else ""))
+
+def epub_package(story, chapters: int) -> str:
+    items = "".join(f'<item id="c{n}" href="chapter{n}.xhtml" media-type="application/xhtml+xml"/>' for n in range(1, chapters + 1))
+    spine = "".join(f'<itemref idref="c{n}"/>' for n in range(1, chapters + 1))
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">'
+            f'<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:identifier id="id">storypath-{story.id}</dc:identifier>'
+            f"<dc:title>{html.escape(story.title)}</dc:title><dc:language>en</dc:language>"
+            f'<meta property="dcterms:modified">2000-01-01T00:00:00Z</meta></metadata>'
+            f'<manifest><item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>{items}</manifest>'
+            f"<spine>{spine}</spine></package>")
+
+def epub_nav(story, chapters: int) -> str:
+    links = "".join(f'<li><a href="chapter{n}.xhtml">Part {n}</a></li>' for n in range(1, chapters + 1))
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+            f"<head><title>{html.escape(story.title)}</title></head><body>"
+            f'<nav epub:type="toc"><ol>{links}</ol></nav></body></html>')
+
+async def export_epub(db: AsyncSession, story):
+    out = ZipStream()
+    book = zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED)
+    # The mimetype entry must come first and be stored uncompressed
+    book.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+    book.writestr("META-INF/container.xml", EPUB_CONTAINER)
+    yield out.drain()
+    chapters, chapter, parts_in_chapter = 0, None, 0
+    async for _, text, chosen in story_parts(db, story):
+        if chapter is None:
+            chapters += 1
+            chapter = book.open(f"OEBPS/chapter{chapters}.xhtml", "w")
+            chapter.write(epub_chapter_start(story, chapters).encode())
+        if chosen:
+            chapter.write(f"<p><em>{html.escape(chosen)}</em></p>".encode())
+        chapter.write("".join(f"<p>{html.escape(line)}</p>" for line in text.split("\n\n")).encode())
+        parts_in_chapter += 1
+        if parts_in_chapter == EPUB_PARTS_PER_CHAPTER:
+            chapter.write(b"</body></html>")
+            chapter.close()
+            chapter, parts_in_chapter = None, 0
+        if out:
+            yield out.drain()
+    if chapter is not None:
+        chapter.write(b"</body></html>")
+        chapter.close()
+    book.writestr("OEBPS/nav.xhtml", epub_nav(story, chapters))
+    book.writestr("OEBPS/content.opf", epub_package(story, chapters))
+    book.close()
+    yield out.drain()
+
+# Every story of a user: one JSON record per line (a "story" record followed by its "part"
+# records), or a zip holding each story as Markdown
+async def export_user_stories(user_id: int, format: str):
+    async with async_session() as db:
+        if format == "ndjson":
+            async for story in user_stories(db, user_id):
+                yield (json.dumps({"type": "story", "id": story.id, "title": story.title, "genre": story.genre}) + "\n").encode()
+                async for part_id, text, chosen in story_parts(db, story):
+                    yield (json.dumps({"type": "part", "story_id": story.id, "id": part_id, "chosen": chosen, "text": text}) + "\n").encode()
+            return
+        out = ZipStream()
+        archive = zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED)
+        async for story in user_stories(db, user_id):
+            with archive.open(f"stories/{export_filename(story, 'md')}", "w") as entry:
+                async for chunk in export_text(db, story, markdown=True):
+                    entry.write(chunk.encode())
+                    if out:
+                        yield out.drain()
+        archive.close()
+        yield out.drain()
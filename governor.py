@@ -0,0 +1,154 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from metrics import GOVERNOR_WAIT_SECONDS
+
+# Admission control for requests that call Gemini. A request is first charged against its
+# user's token bucket and a global one (a starter page costs one token per starter), then
+# takes one of a fixed number of generation slots. When every slot is busy it waits in a
+# bounded FIFO queue, but only up to a deadline. A request that fails any of these steps is
+# rejected at once with GenerationRejected (a 429) rather than left to hang.
+GOVERNOR_USER_PER_MINUTE = float(os.environ.get("GOVERNOR_USER_PER_MINUTE", 30))
+GOVERNOR_USER_BURST = int(os.environ.get("GOVERNOR_USER_BURST", 10))
+GOVERNOR_GLOBAL_PER_MINUTE = float(os.environ.get("GOVERNOR_GLOBAL_PER_MINUTE", 600))
+GOVERNOR_GLOBAL_BURST = int(os.environ.get("GOVERNOR_GLOBAL_BURST", 60))
+GOVERNOR_MAX_CONCURRENT = int(os.environ.get("GOVERNOR_MAX_CONCURRENT", 16))
+GOVERNOR_MAX_QUEUE = int(os.environ.get("GOVERNOR_MAX_QUEUE", 32))
+GOVERNOR_QUEUE_TIMEOUT = float(os.environ.get("GOVERNOR_QUEUE_TIMEOUT", 5))
+# Idle users' buckets are dropped once there are more than this many
+GOVERNOR_MAX_USER_BUCKETS = 10000
+
+class GenerationRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float, cost: int = 1) -> bool:
+        self._refill(now)
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    def give_back(self, cost: int = 1):
+        self.tokens = min(self.burst, self.tokens + cost)
+
+    # Seconds until cost tokens will be available
+    def wait_time(self, now: float, cost: int = 1) -> float:
+        self._refill(now)
+        return max(0.0, (min(cost, self.burst) - self.tokens) / self.rate) if self.rate else float("inf")
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+class GenerationGovernor:
+    def __init__(self, user_per_minute: float = GOVERNOR_USER_PER_MINUTE, user_burst: int = GOVERNOR_USER_BURST,
+                 global_per_minute: float = GOVERNOR_GLOBAL_PER_MINUTE, global_burst: int = GOVERNOR_GLOBAL_BURST,
+                 max_concurrent: int = GOVERNOR_MAX_CONCURRENT, max_queue: int = GOVERNOR_MAX_QUEUE,
+                 queue_timeout: float = GOVERNOR_QUEUE_TIMEOUT):
+        self.user_per_minute = user_per_minute
+        self.user_burst = user_burst
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._global_bucket = TokenBucket(global_per_minute, global_burst)
+        self._user_buckets = {}
+        self._active = 0
+        # Futures of requests waiting for a slot, oldest first
+        self._waiters = deque()
+        self.stats = {
+            "admitted": 0, "queued": 0, "rejected_user_quota": 0, "rejected_global_quota": 0,
+            "rejected_queue_full": 0, "rejected_queue_timeout": 0,
+        }
+
+    def depths(self) -> dict:
+        return {"active": self._active, "waiting": len(self._waiters)}
+
+    # Charges the quotas and takes a slot; pair with release(), or use slot() instead
+    async def acquire(self, user_id: int, cost: int = 1):
+        now = time.monotonic()
+        bucket = self._user_bucket(user_id, now)
+        if not bucket.take(now, cost):
+            self._reject("user_quota", bucket.wait_time(now, cost))
+        if not self._global_bucket.take(now, cost):
+            bucket.give_back(cost)
+            self._reject("global_quota", self._global_bucket.wait_time(now, cost))
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            self.stats["admitted"] += 1
+            GOVERNOR_WAIT_SECONDS.observe(0)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._refund(bucket, cost)
+            self._reject("queue_full", self.queue_timeout)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats["queued"] += 1
+        try:
+            # release() hands its slot straight to the waiter, so _active is already counted
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot arrived just as we gave up; pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            self._refund(bucket, cost)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject("queue_timeout", self.queue_timeout)
+        self.stats["admitted"] += 1
+        GOVERNOR_WAIT_SECONDS.observe(time.monotonic() - now)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, cost: int = 1):
+        await self.acquire(user_id, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _user_bucket(self, user_id: int, now: float) -> TokenBucket:
+        bucket = self._user_buckets.get(user_id)
+        if bucket is None:
+            if len(self._user_buckets) >= GOVERNOR_MAX_USER_BUCKETS:
+                # A full bucket is the same as a new one, so it can go
+                for idle in [key for key, b in self._user_buckets.items() if b.is_full(now)]:
+                    del self._user_buckets[idle]
+            bucket = self._user_buckets[user_id] = TokenBucket(self.user_per_minute, self.user_burst)
+        return bucket
+
+    # Quota taken by a request that was never admitted goes back
+    def _refund(self, bucket: TokenBucket, cost: int):
+        bucket.give_back(cost)
+        self._global_bucket.give_back(cost)
+
+    def _reject(self, reason: str, retry_after: float):
+        self.stats[f"rejected_{reason}"] += 1
+        raise GenerationRejected(reason, retry_after)
+
+governor = GenerationGovernor()
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+GENERATION_WORKERS = int(os.environ.get("GENERATION_WORKERS", 8))
+# Speculative generations allowed per user, and across all users, in any 60 second window
+PREFETCH_PER_USER_PER_MINUTE = int(os.environ.get("PREFETCH_PER_USER_PER_MINUTE", 12))
+PREFETCH_PER_MINUTE = int(os.environ.get("PREFETCH_PER_MINUTE", 120))
+PREFETCH_TTL = int(os.environ.get("PREFETCH_TTL", 900))
+PREFETCH_MAX_ENTRIES = int(os.environ.get("PREFETCH_MAX_ENTRIES", 1000))
+# Idle users' prefetch windows are dropped once there are more than this many
+PREFETCH_MAX_USER_WINDOWS = 10000
+
+def log_failure(key, future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Background job {key} failed: {future.exception()}")
+
+class Job:
+    def __init__(self, user_id: int, key, factory, prefetch: bool = False):
+        self.user_id = user_id
+        self.key = key
+        self.factory = factory
+        self.prefetch = prefetch
+        self.started = False
+        # Written off before it started; the workers skip it
+        self.dropped = False
+        self.future = asyncio.get_running_loop().create_future()
+
+# Per-user FIFO queues served round-robin, so one busy user cannot starve the others
+class FairQueue:
+    def __init__(self):
+        self._queues = {}
+        self._order = deque()
+
+    def push(self, job: Job):
+        if job.user_id not in self._queues:
+            self._queues[job.user_id] = deque()
+            self._order.append(job.user_id)
+        self._queues[job.user_id].append(job)
+
+    def pop(self):
+        if not self._order:
+            return None
+        user_id = self._order.popleft()
+        queue = self._queues[user_id]
+        job = queue.popleft()
+        if queue:
+            self._order.append(user_id)
+        else:
+            del self._queues[user_id]
+        return job
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+class RateWindow:
+    def __init__(self, limit: int, window: float = 60):
+        self.limit = limit
+        self.window = window
+        self._events = deque()
+
+    def allow(self, now: float) -> bool:
+        while self._events and self._events[0] <= now - self.window:
+            self._events.popleft()
+        if len(self._events) >= self.limit:
+            return False
+        self._events.append(now)
+        return True
+
+    def is_empty(self, now: float) -> bool:
+        while self._events and self._events[0] <= now - self.window:
+            self._events.popleft()
+        return not self._events
+
+# Runs Gemini generations on a bounded pool of background workers. Interactive jobs (a user
+# is waiting on the response) always go ahead of speculative prefetches; both lanes are fair
+# across users. Prefetched results are kept by key until claimed, superseded or expired.
+class GenerationQueue:
+    def __init__(self, workers: int = GENERATION_WORKERS, prefetch_per_user: int = PREFETCH_PER_USER_PER_MINUTE,
+                 prefetch_per_minute: int = PREFETCH_PER_MINUTE, prefetch_ttl: int = PREFETCH_TTL,
+                 prefetch_max_entries: int = PREFETCH_MAX_ENTRIES):
+        self.workers = workers
+        self.prefetch_per_user = prefetch_per_user
+        self.prefetch_ttl = prefetch_ttl
+        self.prefetch_max_entries = prefetch_max_entries
+        self._prefetch_window = RateWindow(prefetch_per_minute)
+        self._user_windows = {}
+        self._interactive = FairQueue()
+        self._speculative = FairQueue()
+        self._has_work = None
+        self._tasks = []
+        self._inflight = {}
+        # key -> (job, group, created_at); the job may still be running
+        self._prefetched = OrderedDict()
+        self.stats = {
+            "jobs": 0, "failures": 0,
+            "prefetch_started": 0, "prefetch_hits": 0, "prefetch_misses": 0,
+            "prefetch_wasted": 0, "prefetch_cancelled": 0, "prefetch_over_budget": 0,
+        }
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._has_work = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info(f"Generation queue stats: {self.stats}")
+
+    @property
+    def prefetch_hit_rate(self) -> float:
+        claimed = self.stats["prefetch_hits"] + self.stats["prefetch_misses"]
+        return self.stats["prefetch_hits"] / claimed if claimed else 0.0
+
+    def depths(self) -> dict:
+        return {
+            "queued_interactive": len(self._interactive),
+            "queued_speculative": len(self._speculative),
+            "inflight": len(self._inflight),
+            "prefetched": len(self._prefetched),
+        }
+
+    # Generate on behalf of a waiting user, reusing a prefetched or in-flight result for the key
+    async def run(self, user_id: int, key, factory):
+        await self.start()
+        job = self.claim(key)
+        if job is not None and job.future.done() and job.future.exception() is not None:
+            job = None
+        if job is None:
+            job = self._inflight.get(key) or self._submit(Job(user_id, key, factory))
+        return await asyncio.shield(job.future)
+
+    # Whether claim(key) would return a usable prefetched job
+    def has_prefetched(self, key) -> bool:
+        self._expire()
+        entry = self._prefetched.get(key)
+        if entry is None:
+            return False
+        future = entry[0].future
+        return not (future.done() and future.exception() is not None)
+
+    # Returns the prefetched job for key, if any, and writes off the rest of its group
+    def claim(self, key):
+        self._expire()
+        entry = self._prefetched.pop(key, None)
+        if entry is None:
+            self.stats["prefetch_misses"] += 1
+            return None
+        self.stats["prefetch_hits"] += 1
+        job, group, _ = entry
+        if group is not None:
+            for other_key in [k for k, (_, g, _) in self._prefetched.items() if g == group]:
+                self._drop(other_key)
+        if not job.started:
+            # Someone is waiting on it now, so let it jump the speculative backlog
+            self._interactive.push(job)
+            self._has_work.set()
+        return job
+
+    def prefetch(self, user_id: int, key, factory, group=None) -> bool:
+        if not self._tasks:
+            return False
+        self._expire()
+        if key in self._prefetched or key in self._inflight:
+            return False
+        now = time.monotonic()
+        window = self._user_window(user_id, now)
+        if not window.allow(now) or not self._prefetch_window.allow(now):
+            self.stats["prefetch_over_budget"] += 1
+            return False
+        job = self._submit(Job(user_id, key, factory, prefetch=True))
+        # Nobody may ever await a speculative result, so retrieve failures here
+        job.future.add_done_callback(lambda future: future.cancelled() or future.exception())
+        self._prefetched[key] = (job, group, now)
+        self.stats["prefetch_started"] += 1
+        while len(self._prefetched) > self.prefetch_max_entries:
+            self._drop(next(iter(self._prefetched)))
+        return True
+
+    # Work nobody waits on, such as story summaries: runs in the speculative lane, at most
+    # one job per key at a time, and only logs failures
+    def background(self, user_id: int, key, factory) -> bool:
+        if not self._tasks or key in self._inflight:
+            return False
+        job = self._submit(Job(user_id, key, factory, prefetch=True))
+        job.future.add_done_callback(lambda future: log_failure(key, future))
+        return True
+
+    def _user_window(self, user_id: int, now: float) -> RateWindow:
+        window = self._user_windows.get(user_id)
+        if window is None:
+            if len(self._user_windows) >= PREFETCH_MAX_USER_WINDOWS:
+                # An empty window is the same as a new one, so it can go
+                for idle in [key for key, w in self._user_windows.items() if w.is_empty(now)]:
+                    del self._user_windows[idle]
+            window = self._user_windows[user_id] = RateWindow(self.prefetch_per_user)
+        return window
+
+    def _submit(self, job: Job) -> Job:
+        self._inflight[job.key] = job
+        (self._speculative if job.prefetch else self._interactive).push(job)
+        self._has_work.set()
+        return job
+
+    def _drop(self, key):
+        job, _, _ = self._prefetched.pop(key)
+        self.stats["prefetch_wasted"] += 1
+        if not job.started:
+            # Still queued, so it need not cost a Gemini call at all
+            job.dropped = True
+            job.future.cancel()
+            if self._inflight.get(key) is job:
+                del self._inflight[key]
+            self.stats["prefetch_cancelled"] += 1
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.prefetch_ttl
+        for key in [k for k, (_, _, created_at) in self._prefetched.items() if created_at < cutoff]:
+            self._drop(key)
+
+    async def _worker(self):
+        while True:
+            job = self._interactive.pop() or self._speculative.pop()
+            if job is None:
+                self._has_work.clear()
+                await self._has_work.wait()
+                continue
+            if not job.started and not job.dropped:
+                await self._execute(job)
+
+    # Gemini calls retry on their own (see resilience.py), so a failed job is not run again
+    async def _execute(self, job: Job):
+        job.started = True
+        self.stats["jobs"] += 1
+        try:
+            result = await job.factory()
+        except Exception as e:
+            self.stats["failures"] += 1
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+        finally:
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+
+generation_queue = GenerationQueue()
@@ -1,29 +1,77 @@
+import asyncio
+import json
 import logging
+import math
 import os
-from fastapi import FastAPI, Request, Depends, Form, HTTPException
+from collections import deque
+from typing import Optional
+from urllib.parse import urlencode
+from fastapi import FastAPI, Request, Depends, Form, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse, Response, JSONResponse
+from sqlalchemy import select, insert, update, delete, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import async_engine as engine, get_async_db
-from models import Base, Story, StoryPart, ChoiceOption, Session, SessionParticipant
-from story_generator import generate_story
-from auth import fastapi_users, auth_backend, current_active_user, User, get_user_manager
-from schemas import UserRead, UserCreate
+from database import async_session, get_async_db
+from models import Story, StoryPart, ChoiceOption, Session, SessionParticipant, StoryTranscript
+from story_generator import generate_story, generate_stories, stream_story, parse_story, generator
+from starter_cache import starter_cache
+from transcript import get_transcript, start_transcript, advance_head, move_head
+from story_tree import path_parts_query, path_choices, branch_tip
+from story_context import load_context, schedule_summary
+from jobs import generation_queue
+from governor import governor, GenerationRejected
+from resilience import GeminiUnavailable
+from session_list import list_sessions_page, SESSIONS_PAGE_SIZE
+from events import event_hub
+from singleflight import SingleFlight, Feed
+from export import STORY_FORMATS, BULK_FORMATS, export_story, export_user_stories, export_filename
+from metrics import MetricsMiddleware, StatsCollector, registry, render_metrics
+from compression import CompressionMiddleware
+from conditional import page_etag, is_fresh, not_modified, page_headers, story_version, session_version
+from auth import fastapi_users, auth_backend, cookie_transport, current_active_user, user_from_cookie, User, get_user_manager
+from schemas import UserRead, UserCreate, SessionPage
 import uvicorn
 
 app = FastAPI()
+# Outside compression, so request latency includes the time spent compressing
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 templates = Jinja2Templates(directory="templates")
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Create tables on startup (consider using migrations in production)
-async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+continuations = SingleFlight()
+# Paragraphs of the continuations being streamed, by choice id, for every stream following one
+continuation_feeds = {}
 
+# Optional bearer token for /metrics, for deployments where the app is publicly reachable
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+registry.register(StatsCollector("storypath_generation_queue", "Generation queue", generation_queue.stats, generation_queue.depths))
+registry.register(StatsCollector("storypath_governor", "Generation governor", governor.stats, governor.depths))
+registry.register(StatsCollector("storypath_gemini_resilience", "Gemini retries, hedging and breaker", generator.resilience.stats, generator.resilience.gauges))
+
+# Starters offered per /generate; each is one Gemini call and one governor token
+STARTER_COUNT = 3
+
+# Characters of each part shown in the branch selector
+BRANCH_EXCERPT_CHARS = 240
+
+GENRES = ["fantasy", "sci-fi", "horror", "mystery", "comedy", "action", "adventure", "romance", "drama"]
+
+# The schema is managed by Alembic migrations (`alembic upgrade head`), not created at startup
 @app.on_event("startup")
 async def startup_event():
-    await init_db()
+    await generator.start()
+    await generation_queue.start()
+    await event_hub.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await event_hub.stop()
+    await generation_queue.stop()
+    await generator.close()
 
 # Authentication routes
 app.include_router(
@@ -32,6 +80,37 @@ app.include_router(
     tags=["auth"],
 )
 
+@app.get("/metrics")
+async def metrics(request: Request):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Not authorized")
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
+# Gemini capacity or the user's quota is used up: a page asking to try again for browsers, JSON otherwise
+@app.exception_handler(GenerationRejected)
+async def generation_rejected(request: Request, exc: GenerationRejected):
+    headers = {"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    if "text/html" in request.headers.get("accept", ""):
+        return templates.TemplateResponse("busy.html", {
+            "request": request,
+            "retry_after": headers["Retry-After"],
+            "own_quota": exc.reason == "user_quota",
+        }, status_code=429, headers=headers)
+    return JSONResponse({"detail": "Story generation is busy, try again shortly", "reason": exc.reason}, status_code=429, headers=headers)
+
+# Gemini is failing or too slow (or the breaker is open): the same page, with a 503
+@app.exception_handler(GeminiUnavailable)
+async def gemini_unavailable(request: Request, exc: GeminiUnavailable):
+    headers = {"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    if "text/html" in request.headers.get("accept", ""):
+        return templates.TemplateResponse("busy.html", {
+            "request": request,
+            "retry_after": headers["Retry-After"],
+            "unavailable": True,
+        }, status_code=503, headers=headers)
+    return JSONResponse({"detail": "The storyteller is unavailable, try again shortly", "reason": exc.reason}, status_code=503, headers=headers)
+
 # Registration form
 @app.get("/auth/register")
 async def register_form(request: Request):
@@ -47,11 +126,11 @@ async def register(
     user_manager=Depends(get_user_manager)
 ):
     try:
-        user = await user_manager.create(
+        await user_manager.create(
             UserCreate(username=username, email=email, password=password),
-            safe=True
+            safe=True,
+            request=request
         )
-        await user_manager.on_after_register(user)
         return RedirectResponse(url="/auth/login", status_code=303)
     except Exception as e:
         logger.error(f"Registration failed: {e}")
@@ -69,16 +148,195 @@ async def logout(request: Request):
     response.delete_cookie("fastapiusersauth")
     return response
 
+async def get_story_choice(db: AsyncSession, story_id: int, choice_id: int):
+    return (await db.execute(
+        select(ChoiceOption)
+        .join(StoryPart, ChoiceOption.story_part_id == StoryPart.id)
+        .where(ChoiceOption.id == choice_id, StoryPart.story_id == story_id)
+    )).scalar_one_or_none()
+
+# The story-mutation helpers below only flush; each endpoint commits its unit of work once.
+async def add_choices(db: AsyncSession, story_part_id: int, texts: list) -> list:
+    # One multi-row INSERT ... RETURNING instead of an insert and refresh per choice
+    return (await db.scalars(
+        insert(ChoiceOption).returning(ChoiceOption.id),
+        [{"story_part_id": story_part_id, "text": text} for text in texts],
+    )).all()
+
+async def add_story(db: AsyncSession, user_id: int, genre: str, prompt: str, story_data: dict) -> Story:
+    story = Story(user_id=user_id, genre=genre, title=f"{genre.capitalize()} Tale: {prompt[:20] or 'Untitled'}...")
+    story_part = StoryPart(story=story, text=story_data["story"])
+    db.add_all([story, story_part])
+    await db.flush()
+    story.head_part_id = story_part.id
+    await add_choices(db, story_part.id, story_data["choices"])
+    start_transcript(db, story.id, story_part)
+    return story
+
+class ChoiceAlreadyTaken(Exception):
+    pass
+
+# Returns the new part and the ids of its choices. Raises ChoiceAlreadyTaken if another
+# request continued this choice first; the caller must then roll back.
+async def add_continuation(db: AsyncSession, story_id: int, choice: ChoiceOption, story_data: dict) -> tuple:
+    new_part = StoryPart(story_id=story_id, text=story_data["story"], previous_part_id=choice.story_part_id)
+    db.add(new_part)
+    await db.flush()
+    # Conditional check-and-set: only one transaction can move next_part_id off NULL
+    claimed = await db.execute(
+        update(ChoiceOption)
+        .where(ChoiceOption.id == choice.id, ChoiceOption.next_part_id.is_(None))
+        .values(next_part_id=new_part.id)
+    )
+    if claimed.rowcount != 1:
+        raise ChoiceAlreadyTaken(choice.id)
+    choice_ids = await add_choices(db, new_part.id, story_data["choices"])
+    await advance_head(db, story_id, new_part, choice.text)
+    return new_part, choice_ids
+
+# Before continuing a choice: a choice already continued (a double submit, or a branch written
+# earlier) takes the reader to where that branch was left off; a new choice at an earlier part
+# rewinds the story there first, so the new part starts a branch. Returns whether it moved.
+async def go_to_choice(db: AsyncSession, story: Story, choice: ChoiceOption) -> bool:
+    target = await branch_tip(db, choice.next_part_id) if choice.next_part_id is not None else choice.story_part_id
+    if target == story.head_part_id:
+        return False
+    await move_head(db, story.id, target)
+    await db.commit()
+    return True
+
+# Generates and saves the part that follows a choice, at most once per choice in this worker.
+# Runs under its own DB session because it is shared by every request waiting on the choice.
+async def continue_choice(user_id: int, story_id: int, part_id: int, choice_id: int, choice_text: str, genre: str, channel: str = None):
+    async def generate_and_save():
+        key = ("continue", choice_id)
+        if generation_queue.has_prefetched(key):
+            # Already generated (or generating) in the background, so it costs no quota
+            story_data = await generation_queue.run(user_id, key, continuation_factory(story_id, part_id, choice_text, genre))
+        else:
+            async with governor.slot(user_id):
+                story_data = await generation_queue.run(user_id, key, continuation_factory(story_id, part_id, choice_text, genre))
+        async with async_session() as db:
+            choice = await db.get(ChoiceOption, choice_id)
+            try:
+                new_part, choice_ids = await add_continuation(db, story_id, choice, story_data)
+            except ChoiceAlreadyTaken:
+                # Another worker saved this choice first; keep its part
+                await db.rollback()
+                return
+            await db.commit()
+        schedule_summary(user_id, story_id, genre)
+        if channel:
+            await event_hub.publish(channel, {
+                "type": "part",
+                "part_id": new_part.id,
+                "previous_part_id": new_part.previous_part_id,
+                "chosen": choice_text,
+                "text": new_part.text,
+                "choices": [{"id": id, "text": text} for id, text in zip(choice_ids, story_data["choices"])],
+            })
+
+    await continuations.do(choice_id, generate_and_save)
+
+# Streams the part that follows a choice into feed and saves it: the single flight for the
+# choice while streaming. admitted is resolved once it may go ahead (the prefetch claimed, or
+# a governor slot taken) or fails with the rejection, so the request can still answer 429 or 503.
+async def stream_continuation(user_id: int, story_id: int, part_id: int, choice_id: int, choice_text: str, genre: str, prefetched, feed: Feed, admitted):
+    try:
+        story_data = None
+        if prefetched is not None:
+            admitted.set_result(None)
+            try:
+                # Already generated (or generating) in the background; no need to stream from Gemini
+                story_data = await prefetched.future
+            except Exception as e:
+                # The prefetch failed (e.g. during an outage); generate afresh, as GenerationQueue.run does
+                logger.warning(f"Prefetched continuation failed, streaming afresh: {e}")
+            else:
+                for paragraph in story_data["story"].split("\n\n"):
+                    feed.push(paragraph)
+        if story_data is None:
+            async with async_session() as db:
+                context = await load_context(db, story_id, part_id)
+            generator.resilience.ensure_available()
+            async with governor.slot(user_id):
+                if not admitted.done():
+                    admitted.set_result(None)
+                chunks = []
+                async for paragraph in story_paragraphs(stream_story(choice_text, genre, is_continuation=True, context=context), chunks):
+                    feed.push(paragraph)
+                story_data = parse_story("".join(chunks))
+        async with async_session() as db:
+            choice = await get_story_choice(db, story_id, choice_id)
+            try:
+                await add_continuation(db, story_id, choice, story_data)
+                await db.commit()
+                schedule_summary(user_id, story_id, genre)
+            except ChoiceAlreadyTaken:
+                await db.rollback()
+    except Exception as e:
+        if not admitted.done():
+            admitted.set_exception(e)
+        raise
+    finally:
+        if not admitted.done():
+            admitted.cancel()
+        feed.close()
+        if continuation_feeds.get(choice_id) is feed:
+            del continuation_feeds[choice_id]
+
+# The story context is read when the job runs, so queued prefetches don't hold a connection
+def continuation_factory(story_id: int, part_id: int, choice_text: str, genre: str):
+    async def generate():
+        async with async_session() as db:
+            context = await load_context(db, story_id, part_id)
+        return await generate_story(choice_text, genre, is_continuation=True, context=context)
+    return generate
+
+# Speculatively generate every open choice of the part being shown, so a click can commit a ready result
+def prefetch_continuations(user_id: int, story_id: int, genre: str, transcript: dict):
+    part_id = transcript["current_part_id"]
+    for choice_text, choice_id in transcript["choices"]:
+        # A choice already continued only takes the reader to its branch
+        if choice_id not in transcript["open_choice_ids"]:
+            continue
+        generation_queue.prefetch(user_id, ("continue", choice_id), continuation_factory(story_id, part_id, choice_text, genre), group=part_id)
+
+# Yields a streamed continuation's paragraphs as they complete, collecting the raw text in
+# chunks for parse_story. Its last three lines are the choices, so the three most recent lines
+# are held back until the end of the stream shows which lines those are.
+async def story_paragraphs(stream, chunks: list):
+    pending, held, sent = "", deque(), 0
+    async for chunk in stream:
+        chunks.append(chunk)
+        pending += chunk
+        *lines, pending = pending.split("\n")
+        held.extend(line.strip() for line in lines if line.strip())
+        while len(held) > 3:
+            sent += 1
+            yield held.popleft()
+    if pending.strip():
+        held.append(pending.strip())
+    while len(held) > 3:
+        sent += 1
+        yield held.popleft()
+    if not sent:
+        # Three lines or fewer: parse_story keeps all of it as the story
+        for line in held:
+            yield line
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.get("/")
 async def root(request: Request, user: User = Depends(current_active_user)):
     return templates.TemplateResponse("index.html", {"request": request, "user": user})
 
 @app.get("/generate")
 async def generate_story_form(request: Request, user: User = Depends(current_active_user)):
-    genres = ["fantasy", "sci-fi", "horror", "mystery", "comedy", "action", "adventure", "romance", "drama"]
     return templates.TemplateResponse("generate.html", {
         "request": request,
-        "genres": genres,
+        "genres": GENRES,
         "selected_genre": "fantasy",
         "prompt": "",
         "user": user
@@ -92,12 +350,15 @@ async def generate_starters(
     db: AsyncSession = Depends(get_async_db),
     user: User = Depends(current_active_user)
 ):
-    genres = ["fantasy", "sci-fi", "horror", "mystery", "comedy", "action", "adventure", "romance", "drama"]
-    starters = [(i, generate_story(prompt, genre)["story"]) for i in range(3)]
+    async with governor.slot(user.id, cost=STARTER_COUNT):
+        starter_data = await generate_stories(prompt, genre, count=STARTER_COUNT)
+    token = starter_cache.put(user.id, genre, prompt, starter_data)
+    starters = list(enumerate(data["story"] for data in starter_data))
     return templates.TemplateResponse("generate.html", {
         "request": request,
-        "genres": genres,
+        "genres": GENRES,
         "starters": starters,
+        "starter_token": token,
         "selected_genre": genre,
         "prompt": prompt,
         "user": user
@@ -107,123 +368,240 @@ async def generate_starters(
 async def start_story(
     request: Request,
     starter: int = Form(...),
-    genre: str = Form(...),
-    prompt: str = Form(default=""),
+    starter_token: str = Form(...),
     db: AsyncSession = Depends(get_async_db),
     user: User = Depends(current_active_user)
 ):
-    starters = [generate_story(prompt, genre)["story"] for _ in range(3)]
-    selected_story = starters[starter]
-    
-    story = Story(user_id=user.id, title=f"{genre.capitalize()} Tale: {prompt[:20] or 'Untitled'}...")
-    db.add(story)
-    await db.commit()
-    await db.refresh(story)
-
-    story_data = generate_story(prompt, genre)
-    story_part = StoryPart(story_id=story.id, text=selected_story)
-    db.add(story_part)
-    await db.commit()
-    await db.refresh(story_part)
-
-    choice_objects = [ChoiceOption(story_part_id=story_part.id, text=text) for text in story_data["choices"]]
-    db.add_all(choice_objects)
+    cached = starter_cache.get(starter_token, user.id)
+    if not cached:
+        raise HTTPException(status_code=404, detail="Starters expired, please generate new ones")
+    if not 0 <= starter < len(cached["starters"]):
+        raise HTTPException(status_code=404, detail="Starter not found")
+    genre, prompt = cached["genre"], cached["prompt"]
+    story_data = cached["starters"][starter]
+
+    story = await add_story(db, user.id, genre, prompt, story_data)
     await db.commit()
-    for choice in choice_objects:
-        await db.refresh(choice)
+    starter_cache.discard(starter_token)
 
     return RedirectResponse(url=f"/story/{story.id}", status_code=303)
 
 @app.get("/story/{story_id}")
 async def view_story(request: Request, story_id: int, db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
-    story = (await db.execute(db.query(Story).filter(Story.id == story_id))).scalar_one_or_none()
-    if not story or story.user_id != user.id:
+    version = await story_version(db, story_id)
+    if not version or version.user_id != user.id:
         raise HTTPException(status_code=404, detail="Story not found or not yours")
-    parts = (await db.execute(db.query(StoryPart).filter(StoryPart.story_id == story_id).order_by(StoryPart.id))).scalars().all()
-    current_part = parts[-1] if parts else None
-    choices = (await db.execute(db.query(ChoiceOption).filter(ChoiceOption.story_part_id == current_part.id))).scalars().all() if current_part else []
-    story_text = []
-    for i, part in enumerate(parts):
-        story_text.append(part.text)
-        if i < len(parts) - 1:
-            next_part = parts[i + 1]
-            chosen = (await db.execute(db.query(ChoiceOption).filter(ChoiceOption.story_part_id == part.id, ChoiceOption.next_part_id == next_part.id))).scalar_one_or_none()
-            if chosen:
-                story_text.append(f"<span class='chosen'>{chosen.text}</span>")
+    etag = page_etag("story", story_id, version.head_part_id, user.id)
+    if is_fresh(request, etag):
+        # Its continuations were prefetched when the reader first got this page
+        return not_modified(etag)
+    transcript = await get_transcript(db, story_id)
+    prefetch_continuations(user.id, story_id, version.genre, transcript)
     return templates.TemplateResponse("story.html", {
         "request": request,
-        "story": "\n\n".join(story_text),
-        "choices": [(choice.text, choice.id) for choice in choices],
+        "story": transcript["story"],
+        "choices": transcript["choices"],
         "story_id": story_id,
         "user": user
-    })
+    }, headers=page_headers(etag))
 
 @app.post("/continue/{story_id}/{choice_id}")
 async def continue_story(story_id: int, choice_id: int, db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
-    story = (await db.execute(db.query(Story).filter(Story.id == story_id))).scalar_one_or_none()
+    story = await db.get(Story, story_id)
     if not story or story.user_id != user.id:
         raise HTTPException(status_code=404, detail="Story not found or not yours")
-    choice = (await db.execute(db.query(ChoiceOption).filter(ChoiceOption.id == choice_id))).scalar_one_or_none()
-    if not choice or choice.story_part.story_id != story_id:
+    choice = await get_story_choice(db, story_id, choice_id)
+    if not choice:
         raise HTTPException(status_code=404, detail="Choice not found")
-    
-    genre = story.title.split(':')[0].lower()
-    story_data = generate_story(choice.text, genre, is_continuation=True)
-
-    new_part = StoryPart(story_id=story_id, text=story_data["story"], previous_part_id=choice.story_part_id)
-    db.add(new_part)
-    await db.commit()
-    await db.refresh(new_part)
 
-    choice.next_part_id = new_part.id
-    await db.commit()
+    # A double submit, a second tab or a branch written before: the part already exists, so just show it
+    await go_to_choice(db, story, choice)
+    if choice.next_part_id is None:
+        user_id, part_id, choice_text, genre = user.id, choice.story_part_id, choice.text, story.genre
+        # Hand the connection back to the pool rather than holding it for the whole generation
+        await db.rollback()
+        await continue_choice(user_id, story_id, part_id, choice_id, choice_text, genre)
 
-    choice_objects = [ChoiceOption(story_part_id=new_part.id, text=text) for text in story_data["choices"]]
-    db.add_all(choice_objects)
-    await db.commit()
+    return RedirectResponse(url=f"/story/{story_id}", status_code=303)
 
+# Streams the continuation to the story page as server-sent events: a "paragraph" event per
+# finished paragraph, then "done" once the part and its choices are saved (or "error").
+# Concurrent requests for a choice share one generation, each getting every paragraph.
+@app.post("/continue/{story_id}/{choice_id}/stream")
+async def continue_story_stream(story_id: int, choice_id: int, db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
+    story = await db.get(Story, story_id)
+    if not story or story.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Story not found or not yours")
+    choice = await get_story_choice(db, story_id, choice_id)
+    if not choice:
+        raise HTTPException(status_code=404, detail="Choice not found")
+    await go_to_choice(db, story, choice)
+    already_taken = choice.next_part_id is not None
+
+    flight = continuations.get(choice_id)
+    feed = None if already_taken else continuation_feeds.get(choice_id)
+    if not already_taken and flight is None:
+        # Nobody is continuing this choice yet: stream it as the single flight every later
+        # request for it follows, registered before anything here awaits
+        prefetched = generation_queue.claim(("continue", choice_id))
+        if prefetched is not None and prefetched.future.done() and prefetched.future.exception() is not None:
+            prefetched = None
+        feed = continuation_feeds[choice_id] = Feed()
+        admitted = asyncio.get_running_loop().create_future()
+        user_id, part_id, choice_text, genre = user.id, choice.story_part_id, choice.text, story.genre
+        flight = continuations.start(choice_id, lambda: stream_continuation(user_id, story_id, part_id, choice_id, choice_text, genre, prefetched, feed, admitted))
+        # Rejected before the response starts, so the client gets a plain 429 or 503
+        await asyncio.shield(admitted)
+
+    async def events():
+        try:
+            if feed is not None:
+                async for paragraph in feed.follow():
+                    yield sse_event("paragraph", {"text": paragraph})
+            if flight is not None:
+                # The part is saved once the flight is done
+                await asyncio.shield(flight)
+            yield sse_event("done", {"url": f"/story/{story_id}"})
+        except Exception as e:
+            logger.error(f"Streaming continuation failed: {e}")
+            yield sse_event("error", {"detail": "Story generation failed"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+# The branch selector: every part on the path to the head with all of its choices, in two
+# queries however many branches the story has
+@app.get("/story/{story_id}/branches")
+async def story_branches(request: Request, story_id: int, db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
+    story = await db.get(Story, story_id)
+    if not story or story.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Story not found or not yours")
+    parts = (await db.execute(path_parts_query(story.head_part_id))).all()
+    choices = await path_choices(db, story.head_part_id)
+    on_path = {part_id for part_id, _, _ in parts}
+    steps = [{
+        "part_id": part_id,
+        "chosen": chosen,
+        "excerpt": text if len(text) <= BRANCH_EXCERPT_CHARS else text[:BRANCH_EXCERPT_CHARS].rsplit(" ", 1)[0] + "...",
+        "choices": [{
+            "id": choice.id,
+            "text": choice.text,
+            "state": "open" if choice.next_part_id is None else "path" if choice.next_part_id in on_path else "branch",
+        } for choice in choices.get(part_id, [])],
+    } for part_id, text, chosen in parts]
+    return templates.TemplateResponse("branches.html", {"request": request, "steps": steps, "story_id": story_id, "user": user})
+
+# Go back to an earlier part; the story page then offers that part's choices again
+@app.post("/story/{story_id}/rewind/{part_id}")
+async def rewind_story(story_id: int, part_id: int, db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
+    story = await db.get(Story, story_id)
+    if not story or story.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Story not found or not yours")
+    part = await db.get(StoryPart, part_id)
+    if not part or part.story_id != story_id:
+        raise HTTPException(status_code=404, detail="Part not found")
+    if part_id != story.head_part_id:
+        await move_head(db, story_id, part_id)
+        await db.commit()
     return RedirectResponse(url=f"/story/{story_id}", status_code=303)
 
+@app.get("/story/{story_id}/export")
+async def export_story_file(story_id: int, format: str = "txt", db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
+    if format not in STORY_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format; use one of {', '.join(STORY_FORMATS)}")
+    story = (await db.execute(select(Story.id, Story.user_id, Story.title, Story.genre, Story.head_part_id).where(Story.id == story_id))).first()
+    if not story or story.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Story not found or not yours")
+    media_type, extension = STORY_FORMATS[format]
+    return StreamingResponse(export_story(story, format), media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{export_filename(story, extension)}"',
+    })
+
+# Archive of every story a user has written, for admins
+@app.get("/admin/users/{user_id}/export")
+async def export_user_archive(user_id: int, format: str = "ndjson", user: User = Depends(current_active_user)):
+    if not user.is_superuser:
+        raise HTTPException(status_code=403, detail="Admins only")
+    if format not in BULK_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format; use one of {', '.join(BULK_FORMATS)}")
+    media_type, extension = BULK_FORMATS[format]
+    return StreamingResponse(export_user_stories(user_id, format), media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="user-{user_id}-stories.{extension}"',
+    })
+
 @app.post("/end/{story_id}")
 async def end_story(story_id: int, db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
-    story = (await db.execute(db.query(Story).filter(Story.id == story_id))).scalar_one_or_none()
+    story = await db.get(Story, story_id)
     if not story or story.user_id != user.id:
         raise HTTPException(status_code=404, detail="Story not found or not yours")
-    parts = (await db.execute(db.query(StoryPart).filter(StoryPart.story_id == story_id).order_by(StoryPart.id))).scalars().all()
-    genre = story.title.split(':')[0].lower()
-    ending = generate_story(f"End this {genre} story based on its current progression.", genre, is_continuation=True)
-    new_part = StoryPart(story_id=story_id, text=ending["story"], previous_part_id=parts[-1].id)
+    last_part_id, genre = story.head_part_id, story.genre
+    context = await load_context(db, story_id, last_part_id)
+    async with governor.slot(user.id):
+        ending = await generate_story(f"End this {genre} story based on its current progression.", genre, is_continuation=True, context=context, kind="ending")
+    new_part = StoryPart(story_id=story_id, text=ending["story"], previous_part_id=last_part_id)
     db.add(new_part)
+    await db.flush()
+    await advance_head(db, story_id, new_part)
     await db.commit()
     return RedirectResponse(url=f"/story/{story_id}", status_code=303)
 
 @app.post("/abandon/{story_id}")
-async def abandon_story(story_id: int, confirm: bool = Form(False), db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
-    story = (await db.execute(db.query(Story).filter(Story.id == story_id))).scalar_one_or_none()
+async def abandon_story(request: Request, story_id: int, confirm: bool = Form(False), db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
+    story = await db.get(Story, story_id)
     if not story or story.user_id != user.id:
         raise HTTPException(status_code=404, detail="Story not found or not yours")
     if confirm:
-        db.delete(story)
+        # The cached transcript and the head point into the parts without a relationship the
+        # unit of work could order the deletes by, so they go first; the rest cascades
+        await db.execute(delete(StoryTranscript).where(StoryTranscript.story_id == story_id))
+        story.head_part_id = None
+        await db.flush()
+        await db.delete(story)
         await db.commit()
         return RedirectResponse(url="/generate", status_code=303)
     return templates.TemplateResponse("confirm_abandon.html", {"request": request, "story_id": story_id, "user": user})
 
 @app.post("/save/{story_id}")
 async def save_story(story_id: int, db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
-    story = (await db.execute(db.query(Story).filter(Story.id == story_id))).scalar_one_or_none()
+    story = await db.get(Story, story_id)
     if not story or story.user_id != user.id:
         raise HTTPException(status_code=404, detail="Story not found or not yours")
     return RedirectResponse(url=f"/story/{story_id}", status_code=303)
 
 @app.get("/sessions")
-async def list_sessions(request: Request, db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
-    sessions = (await db.execute(db.query(Session))).scalars().all()
+async def list_sessions(
+    request: Request,
+    cursor: Optional[int] = None,
+    genre: str = "",
+    mine: bool = False,
+    open_seats: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(current_active_user)
+):
+    page = await list_sessions_page(db, user.id, cursor=cursor, genre=genre, mine=mine, open_seats=open_seats)
+    filters = {key: value for key, value in {"genre": genre, "mine": mine, "open_seats": open_seats}.items() if value}
     return templates.TemplateResponse("sessions.html", {
         "request": request,
-        "sessions": sessions,
+        "sessions": page["sessions"],
+        "next_url": f"/sessions?{urlencode({**filters, 'cursor': page['next_cursor']})}" if page["next_cursor"] else None,
+        "genres": GENRES,
+        "selected_genre": genre,
+        "mine": mine,
+        "open_seats": open_seats,
         "user": user
     })
 
+@app.get("/api/sessions", response_model=SessionPage)
+async def list_sessions_api(
+    cursor: Optional[int] = None,
+    genre: str = "",
+    mine: bool = False,
+    open_seats: bool = False,
+    limit: int = SESSIONS_PAGE_SIZE,
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(current_active_user)
+):
+    return await list_sessions_page(db, user.id, cursor=cursor, genre=genre, mine=mine, open_seats=open_seats, limit=limit)
+
 @app.post("/sessions/new")
 async def create_session(
     request: Request,
@@ -232,97 +610,131 @@ async def create_session(
     db: AsyncSession = Depends(get_async_db),
     user: User = Depends(current_active_user)
 ):
-    story = Story(user_id=user.id, title=f"{genre.capitalize()} Tale: {prompt[:20] or 'Untitled'}...")
-    db.add(story)
-    await db.commit()
-    await db.refresh(story)
-
-    story_data = generate_story(prompt, genre)
-    story_part = StoryPart(story_id=story.id, text=story_data["story"])
-    db.add(story_part)
-    await db.commit()
-    await db.refresh(story_part)
-
-    choice_objects = [ChoiceOption(story_part_id=story_part.id, text=text) for text in story_data["choices"]]
-    db.add_all(choice_objects)
-    await db.commit()
-
-    session = Session(story_id=story.id)
+    async with governor.slot(user.id):
+        story_data = await generate_story(prompt, genre)
+    story = await add_story(db, user.id, genre, prompt, story_data)
+    session = Session(story_id=story.id, participants=[SessionParticipant(user_id=user.id)])
     db.add(session)
     await db.commit()
-    await db.refresh(session)
-
-    participant = SessionParticipant(session_id=session.id, user_id=user.id)
-    db.add(participant)
-    await db.commit()
 
     return RedirectResponse(url=f"/session/{session.id}", status_code=303)
 
+# Everything the session page shows; also the snapshot sent to newly connected WebSockets
+async def session_state(db: AsyncSession, session: Session, user_id: int) -> dict:
+    transcript = await get_transcript(db, session.story_id)
+    participants = (await db.execute(select(SessionParticipant).where(SessionParticipant.session_id == session.id))).scalars().all()
+    return {
+        "story": transcript["story"],
+        "choices": transcript["choices"],
+        "open_choice_ids": transcript["open_choice_ids"],
+        "last_part_id": transcript["current_part_id"],
+        "participants": [p.user_id for p in participants],
+        "is_participant": any(p.user_id == user_id for p in participants),
+    }
+
 @app.get("/session/{session_id}")
 async def view_session(request: Request, session_id: int, db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
-    session = (await db.execute(db.query(Session).filter(Session.id == session_id))).scalar_one_or_none()
-    if not session:
+    version = await session_version(db, session_id)
+    if not version:
         raise HTTPException(status_code=404, detail="Session not found")
-    story = session.story
-    parts = (await db.execute(db.query(StoryPart).filter(StoryPart.story_id == story.id).order_by(StoryPart.id))).scalars().all()
-    current_part = parts[-1]
-    choices = (await db.execute(db.query(ChoiceOption).filter(ChoiceOption.story_part_id == current_part.id))).scalars().all()
-    participants = (await db.execute(db.query(SessionParticipant).filter(SessionParticipant.session_id == session_id))).scalars().all()
-    is_participant = any(p.user_id == user.id for p in participants)
-    story_text = []
-    for i, part in enumerate(parts):
-        story_text.append(part.text)
-        if i < len(parts) - 1:
-            next_part = parts[i + 1]
-            chosen = (await db.execute(db.query(ChoiceOption).filter(ChoiceOption.story_part_id == part.id, ChoiceOption.next_part_id == next_part.id))).scalar_one_or_none()
-            if chosen:
-                story_text.append(f"<span class='chosen'>{chosen.text}</span>")
+    session, head_part_id, genre, participant_count, newest_participant_id = version
+    etag = page_etag("session", session_id, head_part_id, participant_count, newest_participant_id, user.id)
+    if is_fresh(request, etag):
+        return not_modified(etag)
+    state = await session_state(db, session, user.id)
+    if state["is_participant"]:
+        prefetch_continuations(user.id, session.story_id, genre, {"choices": state["choices"], "open_choice_ids": state["open_choice_ids"], "current_part_id": state["last_part_id"]})
     return templates.TemplateResponse("session.html", {
         "request": request,
-        "story": "\n\n".join(story_text),
-        "choices": [(choice.text, choice.id) for choice in choices],
+        **state,
         "session_id": session_id,
-        "story_id": story.id,
-        "is_participant": is_participant,
-        "participants": [p.user_id for p in participants],
+        "story_id": session.story_id,
         "user": user
-    })
+    }, headers=page_headers(etag))
+
+# Live session updates: one snapshot on connect, then "part", "participant" and "refresh" deltas
+@app.websocket("/session/{session_id}/ws")
+async def session_updates(websocket: WebSocket, session_id: int):
+    user = await user_from_cookie(websocket.cookies.get(cookie_transport.cookie_name))
+    if user is None:
+        await websocket.close(code=4401)
+        return
+    channel = f"session:{session_id}"
+    # Subscribe before reading the snapshot so no delta can fall between the two
+    queue = event_hub.subscribe(channel)
+    receiver = None
+    try:
+        async with async_session() as db:
+            session = await db.get(Session, session_id)
+            if not session:
+                await websocket.close(code=4404)
+                return
+            snapshot = await session_state(db, session, user.id)
+        await websocket.accept()
+        await websocket.send_json({"type": "snapshot", **snapshot})
+
+        # Clients never send anything; reading only tells us when they go away
+        receiver = asyncio.create_task(websocket.receive_text())
+        while True:
+            getter = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                getter.cancel()
+                break
+            message = getter.result()
+            await websocket.send_json(message)
+            if message["type"] == "refresh":
+                await websocket.close()
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        event_hub.unsubscribe(channel, queue)
+        if receiver is not None:
+            receiver.cancel()
+            if receiver.done() and not receiver.cancelled():
+                # WebSocketDisconnect when the client went away; retrieved so asyncio doesn't log it
+                receiver.exception()
 
 @app.post("/session/{session_id}/join")
 async def join_session(session_id: int, db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
-    session = (await db.execute(db.query(Session).filter(Session.id == session_id))).scalar_one_or_none()
+    session = await db.get(Session, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    if (await db.execute(db.query(SessionParticipant).filter(SessionParticipant.session_id == session_id, SessionParticipant.user_id == user.id))).scalar_one_or_none():
+    if (await db.execute(select(SessionParticipant).where(SessionParticipant.session_id == session_id, SessionParticipant.user_id == user.id))).scalar_one_or_none():
         return RedirectResponse(url=f"/session/{session_id}", status_code=303)
+    participant_count = (await db.execute(select(func.count(SessionParticipant.id)).where(SessionParticipant.session_id == session_id))).scalar()
+    if participant_count >= session.max_participants:
+        raise HTTPException(status_code=409, detail="Session is full")
     participant = SessionParticipant(session_id=session_id, user_id=user.id)
     db.add(participant)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent request joined first; the unique index keeps a single membership
+        await db.rollback()
+    else:
+        await event_hub.publish(f"session:{session_id}", {"type": "participant", "user_id": user.id, "participant_count": participant_count + 1})
     return RedirectResponse(url=f"/session/{session_id}", status_code=303)
 
 @app.post("/session/{session_id}/{choice_id}")
 async def continue_session(session_id: int, choice_id: int, db: AsyncSession = Depends(get_async_db), user: User = Depends(current_active_user)):
-    session = (await db.execute(db.query(Session).filter(Session.id == session_id))).scalar_one_or_none()
-    if not session or not (await db.execute(db.query(SessionParticipant).filter(SessionParticipant.session_id == session_id, SessionParticipant.user_id == user.id))).scalar_one_or_none():
+    session = await db.get(Session, session_id)
+    if not session or not (await db.execute(select(SessionParticipant).where(SessionParticipant.session_id == session_id, SessionParticipant.user_id == user.id))).scalar_one_or_none():
         raise HTTPException(status_code=403, detail="Not a participant")
-    choice = (await db.execute(db.query(ChoiceOption).filter(ChoiceOption.id == choice_id))).scalar_one_or_none()
-    if not choice or choice.story_part.story_id != session.story_id:
+    choice = await get_story_choice(db, session.story_id, choice_id)
+    if not choice:
         raise HTTPException(status_code=404, detail="Choice not found")
-    
-    genre = session.story.title.split(':')[0].lower()
-    story_data = generate_story(choice.text, genre, is_continuation=True)
 
-    new_part = StoryPart(story_id=session.story_id, text=story_data["story"], previous_part_id=choice.story_part_id)
-    db.add(new_part)
-    await db.commit()
-    await db.refresh(new_part)
-
-    choice.next_part_id = new_part.id
-    await db.commit()
-
-    choice_objects = [ChoiceOption(story_part_id=new_part.id, text=text) for text in story_data["choices"]]
-    db.add_all(choice_objects)
-    await db.commit()
+    story = await db.get(Story, session.story_id)
+    if await go_to_choice(db, story, choice):
+        # The story moved to another branch, so every page needs the whole text again
+        await event_hub.publish(f"session:{session_id}", {"type": "refresh"})
+    # Participants voting at the same moment share one generation and one new part
+    if choice.next_part_id is None:
+        user_id, story_id, part_id, choice_text, genre = user.id, story.id, choice.story_part_id, choice.text, story.genre
+        await db.rollback()
+        await continue_choice(user_id, story_id, part_id, choice_id, choice_text, genre, channel=f"session:{session_id}")
 
     return RedirectResponse(url=f"/session/{session_id}", status_code=303)
 
@@ -0,0 +1,134 @@
+import time
+from contextvars import ContextVar
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+# Prometheus metrics for this worker, served at /metrics. Routes are labelled by their path
+# template (/story/{story_id}), never the raw URL, so label cardinality stays fixed.
+registry = CollectorRegistry()
+
+REQUEST_SECONDS = Histogram(
+    "storypath_request_seconds", "HTTP request latency, until the last body chunk is sent",
+    ["method", "route", "status"], registry=registry,
+)
+REQUEST_QUERIES = Histogram(
+    "storypath_request_queries", "SQL statements issued while handling a request",
+    ["method", "route"], buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64), registry=registry,
+)
+REQUEST_QUERY_SECONDS = Histogram(
+    "storypath_request_query_seconds", "Time a request spent waiting on SQL statements",
+    ["method", "route"], registry=registry,
+)
+QUERY_SECONDS = Histogram(
+    "storypath_db_query_seconds", "SQL statement latency", ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5), registry=registry,
+)
+GEMINI_SECONDS = Histogram(
+    "storypath_gemini_seconds", "Gemini call latency, until the full response is read",
+    ["kind", "outcome"], buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60), registry=registry,
+)
+GEMINI_FAILURES = Counter(
+    "storypath_gemini_failures", "Failed Gemini calls by reason (HTTP status or exception type)",
+    ["kind", "reason"], registry=registry,
+)
+GOVERNOR_WAIT_SECONDS = Histogram(
+    "storypath_governor_wait_seconds", "Time an admitted generation request waited for a slot",
+    buckets=(0, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10), registry=registry,
+)
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+GEMINI_PROMPT_TOKENS = Histogram(
+    "storypath_gemini_prompt_tokens", "Prompt tokens per Gemini call, as reported by Gemini",
+    ["kind"], buckets=SIZE_BUCKETS, registry=registry,
+)
+GEMINI_PROMPT_CHARS = Histogram(
+    "storypath_gemini_prompt_chars", "Prompt size per Gemini call", ["kind"], buckets=SIZE_BUCKETS, registry=registry,
+)
+GEMINI_RESPONSE_CHARS = Histogram(
+    "storypath_gemini_response_chars", "Generated text size per Gemini call", ["kind"], buckets=SIZE_BUCKETS, registry=registry,
+)
+
+# SQL statement count and time for the request being handled, set by MetricsMiddleware.
+# Tasks started during the request (e.g. a shared continuation) inherit it.
+request_db_usage = ContextVar("request_db_usage", default=None)
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        usage = {"queries": 0, "seconds": 0.0}
+        token = request_db_usage.set(usage)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_db_usage.reset(token)
+            # The router stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            REQUEST_SECONDS.labels(method, route, str(status)).observe(time.perf_counter() - started)
+            REQUEST_QUERIES.labels(method, route).observe(usage["queries"])
+            REQUEST_QUERY_SECONDS.labels(method, route).observe(usage["seconds"])
+
+def instrument_engine(engine):
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        QUERY_SECONDS.labels(statement.split(None, 1)[0].upper()).observe(elapsed)
+        usage = request_db_usage.get()
+        if usage is not None:
+            usage["queries"] += 1
+            usage["seconds"] += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+def observe_gemini_call(kind: str, seconds: float, error: Exception = None):
+    GEMINI_SECONDS.labels(kind, "error" if error else "ok").observe(seconds)
+    if error is not None:
+        response = getattr(error, "response", None)
+        GEMINI_FAILURES.labels(kind, str(response.status_code) if response is not None else type(error).__name__).inc()
+
+def observe_gemini_sizes(kind: str, prompt_chars: int, response_chars: int, prompt_tokens: int):
+    GEMINI_PROMPT_TOKENS.labels(kind).observe(prompt_tokens)
+    GEMINI_PROMPT_CHARS.labels(kind).observe(prompt_chars)
+    GEMINI_RESPONSE_CHARS.labels(kind).observe(response_chars)
+
+# Exposes a stats dict of running totals (e.g. GenerationQueue.stats) as counters and the
+# dict returned by gauges() as gauges, both read at scrape time
+class StatsCollector:
+    def __init__(self, prefix: str, description: str, stats: dict, gauges=None):
+        self.prefix = prefix
+        self.description = description
+        self.stats = stats
+        self.gauges = gauges
+
+    def collect(self):
+        for name, value in self.stats.items():
+            yield CounterMetricFamily(f"{self.prefix}_{name}", f"{self.description}: {name.replace('_', ' ')}", value=value)
+        for name, value in (self.gauges() if self.gauges else {}).items():
+            yield GaugeMetricFamily(f"{self.prefix}_{name}", f"{self.description}: {name.replace('_', ' ')}", value=value)
+
+def render_metrics():
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,61 @@
+"""initial schema
+
+The tables as the app used to create them with create_all at startup. Databases created
+that way should run `alembic stamp 0001` once instead of upgrading through this revision.
+
+Revision ID: 0001
+Revises:
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("username", sa.String, nullable=False, unique=True),
+        sa.Column("email", sa.String, nullable=False, unique=True),
+        sa.Column("hashed_password", sa.String, nullable=False),
+        sa.Column("is_active", sa.Boolean),
+        sa.Column("is_superuser", sa.Boolean),
+    )
+    op.create_table(
+        "stories",
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("title", sa.String, nullable=False),
+    )
+    op.create_table(
+        "story_parts",
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("story_id", sa.Integer, sa.ForeignKey("stories.id"), nullable=False),
+        sa.Column("text", sa.String, nullable=False),
+        sa.Column("previous_part_id", sa.Integer, sa.ForeignKey("story_parts.id"), nullable=True),
+    )
+    op.create_table(
+        "choice_options",
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("story_part_id", sa.Integer, sa.ForeignKey("story_parts.id"), nullable=False),
+        sa.Column("text", sa.String, nullable=False),
+        sa.Column("next_part_id", sa.Integer, sa.ForeignKey("story_parts.id"), nullable=True),
+    )
+    op.create_table(
+        "sessions",
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("story_id", sa.Integer, sa.ForeignKey("stories.id"), nullable=False),
+    )
+    op.create_table(
+        "session_participants",
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("session_id", sa.Integer, sa.ForeignKey("sessions.id"), nullable=False),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+    )
+
+def downgrade():
+    for table in ["session_participants", "sessions", "choice_options", "story_parts", "stories", "users"]:
+        op.drop_table(table)
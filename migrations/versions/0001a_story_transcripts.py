@@ -0,0 +1,29 @@
+"""story transcripts
+
+The cached transcript of each story's path, which the app started creating at startup
+before the schema moved to Alembic. Databases created by one of those versions already
+have the table, so it is only created where it is missing.
+
+Revision ID: 0001a
+Revises: 0001
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001a"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table("story_transcripts"):
+        return
+    op.create_table(
+        "story_transcripts",
+        sa.Column("story_id", sa.Integer, sa.ForeignKey("stories.id"), primary_key=True),
+        sa.Column("text", sa.Text, nullable=False),
+        sa.Column("last_part_id", sa.Integer, sa.ForeignKey("story_parts.id"), nullable=False),
+    )
+
+def downgrade():
+    op.drop_table("story_transcripts")
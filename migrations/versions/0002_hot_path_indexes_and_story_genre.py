@@ -0,0 +1,51 @@
+"""hot path indexes and story genre
+
+Indexes the foreign keys every page and action filters on, makes (session_id, user_id)
+unique on participants, and stores each story's genre instead of parsing it out of the title.
+
+Revision ID: 0002
+Revises: 0001a
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001a"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index("ix_stories_user_id", "stories", ["user_id"])
+    op.create_index("ix_story_parts_story_id", "story_parts", ["story_id"])
+    op.create_index("ix_choice_options_story_part_id", "choice_options", ["story_part_id"])
+    op.create_index("ix_choice_options_next_part_id", "choice_options", ["next_part_id"])
+    op.create_index("ix_sessions_story_id", "sessions", ["story_id"])
+    op.create_index("ix_session_participants_user_id", "session_participants", ["user_id"])
+
+    # Keep the earliest membership of any duplicate joins before enforcing uniqueness
+    op.execute(
+        "DELETE FROM session_participants WHERE id NOT IN "
+        "(SELECT MIN(id) FROM session_participants GROUP BY session_id, user_id)"
+    )
+    op.create_index("ix_session_participants_session_user", "session_participants", ["session_id", "user_id"], unique=True)
+
+    # Titles look like "Fantasy Tale: ..."; derive the genre from them once, here
+    op.add_column("stories", sa.Column("genre", sa.String, nullable=True))
+    stories = sa.table("stories", sa.column("id", sa.Integer), sa.column("title", sa.String), sa.column("genre", sa.String))
+    connection = op.get_bind()
+    for story_id, title in connection.execute(sa.select(stories.c.id, stories.c.title)).all():
+        genre = title.split(" Tale:")[0].split(":")[0].strip().lower() or "fantasy"
+        connection.execute(stories.update().where(stories.c.id == story_id).values(genre=genre))
+    with op.batch_alter_table("stories") as batch:
+        batch.alter_column("genre", existing_type=sa.String, nullable=False)
+
+def downgrade():
+    with op.batch_alter_table("stories") as batch:
+        batch.drop_column("genre")
+    op.drop_index("ix_session_participants_session_user", "session_participants")
+    op.drop_index("ix_session_participants_user_id", "session_participants")
+    op.drop_index("ix_sessions_story_id", "sessions")
+    op.drop_index("ix_choice_options_next_part_id", "choice_options")
+    op.drop_index("ix_choice_options_story_part_id", "choice_options")
+    op.drop_index("ix_story_parts_story_id", "story_parts")
+    op.drop_index("ix_stories_user_id", "stories")
@@ -0,0 +1,21 @@
+"""session seats
+
+Gives every session a participant limit so the sessions list can filter on open seats.
+
+Revision ID: 0003
+Revises: 0002
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column("sessions", sa.Column("max_participants", sa.Integer, nullable=False, server_default="4"))
+
+def downgrade():
+    with op.batch_alter_table("sessions") as batch:
+        batch.drop_column("max_participants")
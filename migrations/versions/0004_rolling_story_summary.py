@@ -0,0 +1,28 @@
+"""rolling story summary
+
+Stores a running summary of each story next to its transcript, so continuation prompts
+can carry the story so far without sending the whole transcript.
+
+Revision ID: 0004
+Revises: 0003
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Existing stories start without a summary; it is built from their parts on the next new part
+    with op.batch_alter_table("story_transcripts") as batch:
+        batch.add_column(sa.Column("summary", sa.Text, nullable=True))
+        batch.add_column(sa.Column("summary_part_id", sa.Integer, nullable=True))
+        batch.create_foreign_key("fk_story_transcripts_summary_part_id", "story_parts", ["summary_part_id"], ["id"])
+
+def downgrade():
+    with op.batch_alter_table("story_transcripts") as batch:
+        batch.drop_constraint("fk_story_transcripts_summary_part_id", type_="foreignkey")
+        batch.drop_column("summary_part_id")
+        batch.drop_column("summary")
@@ -0,0 +1,33 @@
+"""story branches
+
+Gives each story a head pointer (the part the reader is on) so earlier parts can be revisited
+and continued with a different choice, and indexes previous_part_id for walking down branches.
+
+Revision ID: 0005
+Revises: 0004
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index("ix_story_parts_previous_part_id", "story_parts", ["previous_part_id"])
+    with op.batch_alter_table("stories") as batch:
+        batch.add_column(sa.Column("head_part_id", sa.Integer, nullable=True))
+        batch.create_foreign_key("fk_stories_head_part_id", "story_parts", ["head_part_id"], ["id"], ondelete="SET NULL")
+    # Stories so far are linear, so the head is where the transcript ends: the newest part
+    op.execute(
+        "UPDATE stories SET head_part_id = COALESCE("
+        "(SELECT last_part_id FROM story_transcripts WHERE story_transcripts.story_id = stories.id), "
+        "(SELECT MAX(id) FROM story_parts WHERE story_parts.story_id = stories.id))"
+    )
+
+def downgrade():
+    with op.batch_alter_table("stories") as batch:
+        batch.drop_constraint("fk_stories_head_part_id", type_="foreignkey")
+        batch.drop_column("head_part_id")
+    op.drop_index("ix_story_parts_previous_part_id", "story_parts")
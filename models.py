@@ -1,9 +1,12 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean
+import os
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
+SESSION_MAX_PARTICIPANTS = int(os.environ.get("SESSION_MAX_PARTICIPANTS", 4))
+
 # User model from auth.py
 class User(Base):
     __tablename__ = "users"
@@ -19,42 +22,63 @@ class User(Base):
 class Story(Base):
     __tablename__ = "stories"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     title = Column(String, nullable=False)
+    genre = Column(String, nullable=False)
+    # The part the reader is on; the story shown is the path from the first part down to it
+    head_part_id = Column(Integer, ForeignKey("story_parts.id", use_alter=True, name="fk_stories_head_part_id", ondelete="SET NULL"), nullable=True)
     user = relationship("User", back_populates="stories")
-    parts = relationship("StoryPart", back_populates="story")
-    session = relationship("Session", back_populates="story", uselist=False)
+    parts = relationship("StoryPart", back_populates="story", foreign_keys="StoryPart.story_id", cascade="all, delete-orphan")
+    session = relationship("Session", back_populates="story", uselist=False, cascade="all, delete-orphan")
+    transcript = relationship("StoryTranscript", back_populates="story", uselist=False, cascade="all, delete-orphan")
 
 class StoryPart(Base):
     __tablename__ = "story_parts"
     id = Column(Integer, primary_key=True, index=True)
-    story_id = Column(Integer, ForeignKey("stories.id"), nullable=False)
+    story_id = Column(Integer, ForeignKey("stories.id"), nullable=False, index=True)
     text = Column(String, nullable=False)
-    previous_part_id = Column(Integer, ForeignKey("story_parts.id"), nullable=True)
-    story = relationship("Story", back_populates="parts")
-    choices = relationship("ChoiceOption", back_populates="story_part", foreign_keys="ChoiceOption.story_part_id")
+    # Indexed for walking down a branch (a part's children)
+    previous_part_id = Column(Integer, ForeignKey("story_parts.id"), nullable=True, index=True)
+    story = relationship("Story", back_populates="parts", foreign_keys=[story_id])
+    choices = relationship("ChoiceOption", back_populates="story_part", foreign_keys="ChoiceOption.story_part_id", cascade="all, delete-orphan")
     previous_part = relationship("StoryPart", remote_side=[id])
 
 class ChoiceOption(Base):
     __tablename__ = "choice_options"
     id = Column(Integer, primary_key=True, index=True)
-    story_part_id = Column(Integer, ForeignKey("story_parts.id"), nullable=False)
+    story_part_id = Column(Integer, ForeignKey("story_parts.id"), nullable=False, index=True)
     text = Column(String, nullable=False)
-    next_part_id = Column(Integer, ForeignKey("story_parts.id"), nullable=True)
+    next_part_id = Column(Integer, ForeignKey("story_parts.id"), nullable=True, index=True)
     story_part = relationship("StoryPart", back_populates="choices", foreign_keys=[story_part_id])
     next_part = relationship("StoryPart", foreign_keys=[next_part_id])
 
+# Rendered story text for the path ending at last_part_id (the story's head), appended to as
+# parts are added and rebuilt when the reader moves to another branch.
+# summary is a rolling Gemini summary of the path up to summary_part_id, refreshed in the
+# background after each new part so continuation prompts stay the same size as stories grow.
+class StoryTranscript(Base):
+    __tablename__ = "story_transcripts"
+    story_id = Column(Integer, ForeignKey("stories.id"), primary_key=True)
+    text = Column(Text, nullable=False)
+    last_part_id = Column(Integer, ForeignKey("story_parts.id"), nullable=False)
+    summary = Column(Text, nullable=True)
+    summary_part_id = Column(Integer, ForeignKey("story_parts.id"), nullable=True)
+    story = relationship("Story", back_populates="transcript")
+
 class Session(Base):
     __tablename__ = "sessions"
     id = Column(Integer, primary_key=True, index=True)
-    story_id = Column(Integer, ForeignKey("stories.id"), nullable=False)
+    story_id = Column(Integer, ForeignKey("stories.id"), nullable=False, index=True)
+    max_participants = Column(Integer, nullable=False, default=SESSION_MAX_PARTICIPANTS, server_default=str(SESSION_MAX_PARTICIPANTS))
     story = relationship("Story", back_populates="session")
-    participants = relationship("SessionParticipant", back_populates="session")
+    participants = relationship("SessionParticipant", back_populates="session", cascade="all, delete-orphan")
 
 class SessionParticipant(Base):
     __tablename__ = "session_participants"
+    # Serves the membership check on every session action and rejects duplicate joins
+    __table_args__ = (Index("ix_session_participants_session_user", "session_id", "user_id", unique=True),)
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("sessions.id"), nullable=False)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     session = relationship("Session", back_populates="participants")
     user = relationship("User", back_populates="sessions")
\ No newline at end of file
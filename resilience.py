@@ -0,0 +1,294 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+import httpx
+
+# Deadlines, retries, hedging and a circuit breaker for Gemini calls, configured per call kind:
+# "story" (starters and new sessions), "continuation", "ending" and "summary".
+#  - Every attempt has a timeout and the call as a whole a deadline.
+#  - 429s, 5xx, transport errors and timed-out attempts are retried with jittered exponential
+#    backoff (or after Gemini's Retry-After) while the deadline allows.
+#  - An attempt still running after the kind's recent latency percentile gets a duplicate, and
+#    whichever answers first wins. Hedges are capped at a share of all calls.
+#  - When too many recent attempts failed the breaker opens: calls fail at once with
+#    GeminiUnavailable (the app shows a try-again page) until a probe call gets through.
+# A kind's policy can be overridden with GEMINI_POLICY_<KIND>, e.g.
+# GEMINI_POLICY_CONTINUATION="attempt_timeout=15,total_timeout=30,retries=1,hedge_percentile=0"
+GEMINI_HEDGE_MAX_RATIO = float(os.environ.get("GEMINI_HEDGE_MAX_RATIO", 0.1))
+GEMINI_BREAKER_FAILURE_RATE = float(os.environ.get("GEMINI_BREAKER_FAILURE_RATE", 0.5))
+GEMINI_BREAKER_MIN_CALLS = int(os.environ.get("GEMINI_BREAKER_MIN_CALLS", 10))
+GEMINI_BREAKER_COOLDOWN = float(os.environ.get("GEMINI_BREAKER_COOLDOWN", 30))
+# Recent attempts the breaker's failure rate is taken over
+BREAKER_WINDOW = 20
+# Successful attempt latencies kept per kind, and how many are needed before hedging starts
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+class GeminiUnavailable(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class CallPolicy:
+    def __init__(self, attempt_timeout: float, total_timeout: float, retries: int = 2, backoff: float = 0.5, hedge_percentile: float = 95):
+        self.attempt_timeout = float(attempt_timeout)
+        self.total_timeout = float(total_timeout)
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        # 0 turns hedging off
+        self.hedge_percentile = float(hedge_percentile)
+
+    # A copy with the fields named in a "key=value,key=value" string replaced
+    def override(self, spec: str) -> "CallPolicy":
+        fields = dict(vars(self))
+        for item in filter(None, (item.strip() for item in spec.split(","))):
+            key, _, value = item.partition("=")
+            if key.strip() not in fields:
+                raise ValueError(f"Unknown Gemini policy setting: {key}")
+            fields[key.strip()] = type(fields[key.strip()])(float(value))
+        return CallPolicy(**fields)
+
+DEFAULT_POLICIES = {
+    "story": CallPolicy(attempt_timeout=20, total_timeout=40),
+    "continuation": CallPolicy(attempt_timeout=20, total_timeout=40),
+    "ending": CallPolicy(attempt_timeout=30, total_timeout=60, retries=1),
+    # Nobody waits on a summary, so it can take longer and is never worth a duplicate call
+    "summary": CallPolicy(attempt_timeout=30, total_timeout=90, retries=3, hedge_percentile=0),
+}
+
+def policies_from_env(defaults: dict = DEFAULT_POLICIES) -> dict:
+    return {kind: policy.override(os.environ.get(f"GEMINI_POLICY_{kind.upper()}", "")) for kind, policy in defaults.items()}
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+# Seconds Gemini asked us to wait in a Retry-After header, if any
+def retry_after_header(error: Exception):
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+class CircuitBreaker:
+    def __init__(self, failure_rate: float = GEMINI_BREAKER_FAILURE_RATE, min_calls: int = GEMINI_BREAKER_MIN_CALLS,
+                 cooldown: float = GEMINI_BREAKER_COOLDOWN, window: int = BREAKER_WINDOW):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._outcomes = deque(maxlen=window)
+        self._probing = False
+
+    # Whether a call may go ahead. Once the cooldown is over a single probe call is let
+    # through (half-open); its outcome closes or reopens the breaker.
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    # Like allow(), but without taking the probe
+    def is_open(self) -> bool:
+        return self.state == "open" and time.monotonic() - self.opened_at < self.cooldown or self.state == "half_open" and self._probing
+
+    def record(self, success: bool):
+        if self.state == "half_open":
+            self._probing = False
+            if success:
+                self.state = "closed"
+                self._outcomes.clear()
+            else:
+                self._open()
+            return
+        self._outcomes.append(success)
+        if self.state == "closed" and len(self._outcomes) >= self.min_calls and self._outcomes.count(False) >= self.failure_rate * len(self._outcomes):
+            self._open()
+
+    # A probe that ended without a verdict (cancelled, or a request Gemini refused as invalid)
+    def end_probe(self):
+        self._probing = False
+
+    def retry_after(self) -> float:
+        if self.state == "open":
+            return max(1.0, self.cooldown - (time.monotonic() - self.opened_at))
+        return 1.0
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self._outcomes.clear()
+
+class Resilience:
+    def __init__(self, policies: dict = None, breaker: CircuitBreaker = None, hedge_max_ratio: float = GEMINI_HEDGE_MAX_RATIO):
+        self.policies = policies if policies is not None else policies_from_env()
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge_max_ratio = hedge_max_ratio
+        self._latencies = {}
+        self.stats = {
+            "calls": 0, "attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+            "attempt_timeouts": 0, "deadline_exceeded": 0, "short_circuited": 0, "breaker_opened": 0,
+        }
+
+    def policy(self, kind: str) -> CallPolicy:
+        return self.policies.get(kind) or self.policies["story"]
+
+    def gauges(self) -> dict:
+        return {"breaker_open": int(self.breaker.state != "closed")}
+
+    # Refuses a call if the breaker is open; returns whether the call is the half-open probe
+    def admit(self) -> bool:
+        probe = self.breaker.state != "closed"
+        if not self.breaker.allow():
+            self.stats["short_circuited"] += 1
+            raise GeminiUnavailable("circuit_open", self.breaker.retry_after())
+        self.stats["calls"] += 1
+        return probe
+
+    # For callers that must refuse before doing anything else, e.g. before a response starts
+    def ensure_available(self):
+        if self.breaker.is_open():
+            self.stats["short_circuited"] += 1
+            raise GeminiUnavailable("circuit_open", self.breaker.retry_after())
+
+    # Waits, until the call's deadline, for one of the caller's own slots (e.g. its share of
+    # the connection pool). That wait is ours, not Gemini's, so it is not part of the attempt:
+    # it is neither timed nor held against the breaker.
+    async def acquire_slot(self, slots: asyncio.Semaphore, deadline: float):
+        try:
+            await asyncio.wait_for(slots.acquire(), deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            self.stats["deadline_exceeded"] += 1
+            raise GeminiUnavailable("deadline", self.breaker.retry_after()) from None
+
+    # Timeout for the next attempt: its own limit, cut short by the call's deadline
+    def time_left(self, policy: CallPolicy, deadline: float) -> float:
+        return max(0.0, min(policy.attempt_timeout, deadline - time.monotonic()))
+
+    def attempt_succeeded(self, kind: str, seconds: float = None):
+        self.breaker.record(True)
+        if seconds is not None:
+            self._latencies.setdefault(kind, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def attempt_failed(self, error: Exception):
+        if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)):
+            self.stats["attempt_timeouts"] += 1
+        # Requests Gemini rejected as invalid say nothing about its health
+        if is_retryable(error):
+            opened = self.breaker.times_opened
+            self.breaker.record(False)
+            self.stats["breaker_opened"] += self.breaker.times_opened - opened
+
+    # Seconds to wait before retrying after error; raises when the call should give up instead
+    def retry_delay(self, error: Exception, attempt: int, policy: CallPolicy, deadline: float) -> float:
+        if not is_retryable(error):
+            raise error
+        if attempt >= policy.retries:
+            raise GeminiUnavailable("upstream_error", self.breaker.retry_after()) from error
+        delay = retry_after_header(error)
+        if delay is None:
+            delay = policy.backoff * 2 ** attempt
+            delay += random.uniform(0, delay)
+        if time.monotonic() + delay >= deadline:
+            self.stats["deadline_exceeded"] += 1
+            raise GeminiUnavailable("deadline", self.breaker.retry_after()) from error
+        if self.breaker.is_open():
+            raise GeminiUnavailable("circuit_open", self.breaker.retry_after()) from error
+        self.stats["retries"] += 1
+        return delay
+
+    # Runs attempt(timeout) under the kind's policy and returns the first successful result.
+    # Each attempt first takes one of slots, if given, outside its timeout.
+    async def call(self, kind: str, attempt, slots: asyncio.Semaphore = None):
+        policy = self.policy(kind)
+        probe = self.admit()
+        deadline = time.monotonic() + policy.total_timeout
+        try:
+            for number in range(policy.retries + 1):
+                try:
+                    return await self._hedged(kind, policy, attempt, deadline, slots)
+                except Exception as e:
+                    await asyncio.sleep(self.retry_delay(e, number, policy, deadline))
+        finally:
+            if probe:
+                self.breaker.end_probe()
+
+    async def _attempt(self, kind: str, policy: CallPolicy, attempt, deadline: float, slots: asyncio.Semaphore = None):
+        if slots is not None:
+            await self.acquire_slot(slots, deadline)
+        try:
+            timeout = self.time_left(policy, deadline)
+            self.stats["attempts"] += 1
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(attempt(timeout), timeout)
+            except Exception as e:
+                self.attempt_failed(e)
+                raise
+            self.attempt_succeeded(kind, time.monotonic() - started)
+            return result
+        finally:
+            if slots is not None:
+                slots.release()
+
+    # One attempt, plus a duplicate if it is still running after the hedge delay
+    async def _hedged(self, kind: str, policy: CallPolicy, attempt, deadline: float, slots: asyncio.Semaphore = None):
+        first = asyncio.ensure_future(self._attempt(kind, policy, attempt, deadline, slots))
+        delay = self._hedge_delay(kind, policy, deadline)
+        if delay is None:
+            return await first
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+        except BaseException:
+            first.cancel()
+            raise
+        if done or not self._hedge_allowed():
+            return await first
+        self.stats["hedges"] += 1
+        second = asyncio.ensure_future(self._attempt(kind, policy, attempt, deadline, slots))
+        pending, error = {first, second}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _hedge_delay(self, kind: str, policy: CallPolicy, deadline: float):
+        latencies = self._latencies.get(kind)
+        if not policy.hedge_percentile or latencies is None or len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(latencies)
+        delay = ordered[min(len(ordered) - 1, int(len(ordered) * policy.hedge_percentile / 100))]
+        # A duplicate that could not finish before the attempt times out is no use
+        return delay if delay < self.time_left(policy, deadline) / 2 else None
+
+    def _hedge_allowed(self) -> bool:
+        return self.stats["hedges"] < self.hedge_max_ratio * self.stats["calls"]
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import List, Optional
+from fastapi_users import schemas
 
 # Read schema (response)
 class UserRead(BaseModel):
@@ -12,13 +13,22 @@ class UserRead(BaseModel):
     class Config:
         from_attributes = True  # Updated for Pydantic V2
 
-# Create schema (request)
-class UserCreate(BaseModel):
+# Create schema (request); the fastapi-users base provides create_update_dict for UserManager.create
+class UserCreate(schemas.BaseUserCreate):
     username: str
-    email: EmailStr
-    password: str
-    is_active: Optional[bool] = True
-    is_superuser: Optional[bool] = False
 
     class Config:
-        from_attributes = True  # Updated for Pydantic V2
\ No newline at end of file
+        from_attributes = True  # Updated for Pydantic V2
+
+# Sessions listing (JSON variant of /sessions)
+class SessionSummary(BaseModel):
+    id: int
+    title: str
+    genre: str
+    participant_count: int
+    max_participants: int
+    is_member: bool
+
+class SessionPage(BaseModel):
+    sessions: List[SessionSummary]
+    next_cursor: Optional[int] = None
@@ -0,0 +1,49 @@
+import os
+from sqlalchemy import select, func, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Story, Session, SessionParticipant
+
+SESSIONS_PAGE_SIZE = int(os.environ.get("SESSIONS_PAGE_SIZE", 20))
+SESSIONS_MAX_PAGE_SIZE = 100
+
+# One page of sessions, newest first, in a single query. Pages are keyed on the last session
+# id seen (keyset pagination), so deep pages cost the same as the first one.
+async def list_sessions_page(db: AsyncSession, user_id: int, cursor: int = None, genre: str = None,
+                             mine: bool = False, open_seats: bool = False, limit: int = SESSIONS_PAGE_SIZE) -> dict:
+    limit = max(1, min(limit, SESSIONS_MAX_PAGE_SIZE))
+    participant_count = (
+        select(func.count(SessionParticipant.id))
+        .where(SessionParticipant.session_id == Session.id)
+        .correlate(Session)
+        .scalar_subquery()
+    )
+    is_member = exists().where(SessionParticipant.session_id == Session.id, SessionParticipant.user_id == user_id)
+    query = (
+        select(Session.id, Session.max_participants, Story.title, Story.genre,
+               participant_count.label("participant_count"), is_member.label("is_member"))
+        .join(Story, Session.story_id == Story.id)
+        .order_by(Session.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        query = query.where(Session.id < cursor)
+    if genre:
+        query = query.where(Story.genre == genre)
+    if mine:
+        query = query.where(is_member)
+    if open_seats:
+        query = query.where(participant_count < Session.max_participants)
+
+    rows = (await db.execute(query)).all()
+    sessions = [
+        {
+            "id": row.id,
+            "title": row.title,
+            "genre": row.genre,
+            "participant_count": row.participant_count,
+            "max_participants": row.max_participants,
+            "is_member": bool(row.is_member),
+        }
+        for row in rows[:limit]
+    ]
+    return {"sessions": sessions, "next_cursor": sessions[-1]["id"] if len(rows) > limit else None}
@@ -0,0 +1,62 @@
+import asyncio
+
+# Collapses concurrent calls for the same key into one: the first caller starts the work as
+# its own task and everyone who arrives before it finishes awaits that same result. The task
+# is shielded, so a caller disconnecting does not cancel the work for the others.
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+
+    # The task in flight for key, or None
+    def get(self, key):
+        return self._calls.get(key)
+
+    async def do(self, key, fn):
+        return await asyncio.shield(self.start(key, fn))
+
+    # Starts fn as the call for key unless one is already in flight, and returns its task.
+    # Registered before returning, so a caller can claim key without awaiting anything.
+    def start(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return task
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Retrieved here in case every caller went away before it finished
+            task.exception()
+
+# What an in-flight call has produced so far, for everyone waiting on it: follow() yields
+# every item from the first, then each new one as it is pushed, until the feed is closed.
+class Feed:
+    def __init__(self):
+        self.items = []
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    def push(self, item):
+        self.items.append(item)
+        self._notify()
+
+    def close(self):
+        self.closed = True
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        sent = 0
+        while True:
+            while sent < len(self.items):
+                yield self.items[sent]
+                sent += 1
+            if self.closed:
+                return
+            await self._changed.wait()
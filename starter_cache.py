@@ -0,0 +1,48 @@
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+# Starters shown on /generate are kept server-side so /start can persist the one the user
+# picked without calling Gemini again. Entries live in this worker's memory only.
+STARTER_CACHE_TTL = int(os.environ.get("STARTER_CACHE_TTL", 1800))
+STARTER_CACHE_SIZE = int(os.environ.get("STARTER_CACHE_SIZE", 1024))
+
+class StarterCache:
+    def __init__(self, ttl: int = STARTER_CACHE_TTL, max_entries: int = STARTER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def put(self, user_id: int, genre: str, prompt: str, starters: list) -> str:
+        token = secrets.token_urlsafe(16)
+        self._entries[token] = {
+            "user_id": user_id,
+            "genre": genre,
+            "prompt": prompt,
+            "starters": starters,
+            "expires_at": time.monotonic() + self.ttl,
+        }
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return token
+
+    def get(self, token: str, user_id: int):
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        if entry["expires_at"] < time.monotonic():
+            del self._entries[token]
+            return None
+        if entry["user_id"] != user_id:
+            return None
+        self._entries.move_to_end(token)
+        return entry
+
+    def discard(self, token: str):
+        self._entries.pop(token, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+starter_cache = StarterCache()
@@ -0,0 +1,89 @@
+import logging
+import os
+from sqlalchemy import select, update, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import async_session
+from models import StoryPart, StoryTranscript
+from story_generator import summarize_story
+from jobs import generation_queue
+from story_tree import path_cte
+
+logger = logging.getLogger(__name__)
+
+# Continuation and ending prompts carry the story's rolling summary plus the parts it doesn't
+# cover yet (normally just the latest one) instead of the whole transcript, so prompt size
+# stays flat however long a story gets.
+PROMPT_CONTEXT_TOKENS = int(os.environ.get("PROMPT_CONTEXT_TOKENS", 1200))
+SUMMARY_MAX_WORDS = int(os.environ.get("SUMMARY_MAX_WORDS", 200))
+# Unsummarized parts read per prompt; more than this never fit the budget anyway
+CONTEXT_MAX_PARTS = 10
+CHARS_PER_TOKEN = 4
+
+# The summary may use up to half the budget; the newest parts get the rest, trimmed from
+# the front so the text right before the choice always survives.
+def fit_context(summary: str, recent_parts: list, budget: int = PROMPT_CONTEXT_TOKENS) -> str:
+    budget_chars = budget * CHARS_PER_TOKEN
+    summary = (summary or "")[:budget_chars // 2]
+    remaining = budget_chars - len(summary)
+    recent = []
+    for text in reversed(recent_parts):
+        if remaining <= 0:
+            break
+        recent.insert(0, text[-remaining:])
+        remaining -= len(text) + 2
+    context = f"Summary of the story so far:\n{summary}\n\n" if summary else ""
+    if recent:
+        context += "Latest in the story:\n" + "\n\n".join(recent)
+    return context.strip()
+
+# The parts on the path to up_to_part_id that come after after_part_id, oldest first. The walk
+# up the path stops at after_part_id or after CONTEXT_MAX_PARTS parts, whichever is first.
+async def unsummarized_parts(db: AsyncSession, story_id: int, after_part_id: int, up_to_part_id: int) -> list:
+    min_id = after_part_id + 1 if after_part_id is not None else None
+    path = path_cte(up_to_part_id, min_id=min_id, max_depth=CONTEXT_MAX_PARTS - 1)
+    query = select(StoryPart.text).join(path, path.c.id == StoryPart.id).where(StoryPart.story_id == story_id)
+    if min_id is not None:
+        query = query.where(StoryPart.id >= min_id)
+    return (await db.execute(query.order_by(path.c.depth.desc()))).scalars().all()
+
+# The story up to and including part_id, ready to go into a prompt. Two small queries.
+# The summary belongs to the path to the story's head, so part_id should be the head.
+async def load_context(db: AsyncSession, story_id: int, part_id: int) -> str:
+    row = (await db.execute(
+        select(StoryTranscript.summary, StoryTranscript.summary_part_id).where(StoryTranscript.story_id == story_id)
+    )).first()
+    summary, summary_part_id = row if row else (None, None)
+    return fit_context(summary, await unsummarized_parts(db, story_id, summary_part_id, part_id))
+
+# Folds the parts added since the last refresh into the summary. Runs in the background,
+# under its own session, and never moves a summary backwards or onto a branch the reader left.
+async def refresh_summary(story_id: int, genre: str):
+    async with async_session() as db:
+        row = (await db.execute(
+            select(StoryTranscript.summary, StoryTranscript.summary_part_id, StoryTranscript.last_part_id)
+            .where(StoryTranscript.story_id == story_id)
+        )).first()
+        if row is None or row.summary_part_id == row.last_part_id:
+            return
+        new_parts = await unsummarized_parts(db, story_id, row.summary_part_id, row.last_part_id)
+        new_text = fit_context(None, new_parts, PROMPT_CONTEXT_TOKENS - len(row.summary or "") // CHARS_PER_TOKEN)
+        # Don't hold a pooled connection while Gemini writes the summary
+        await db.rollback()
+        summary = await summarize_story(row.summary, new_text, genre, SUMMARY_MAX_WORDS)
+        covered = StoryTranscript.summary_part_id
+        head = select(StoryTranscript.last_part_id).where(StoryTranscript.story_id == story_id).scalar_subquery()
+        path = path_cte(head, min_id=row.last_part_id)
+        await db.execute(
+            update(StoryTranscript)
+            .where(
+                StoryTranscript.story_id == story_id,
+                covered.is_(None) if row.summary_part_id is None else covered == row.summary_part_id,
+                # The summarized parts must still lead to the head
+                exists(select(path.c.id).where(path.c.id == row.last_part_id)),
+            )
+            .values(summary=summary, summary_part_id=row.last_part_id)
+        )
+        await db.commit()
+
+def schedule_summary(user_id: int, story_id: int, genre: str):
+    generation_queue.background(user_id, ("summary", story_id), lambda: refresh_summary(story_id, genre))
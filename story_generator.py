@@ -1,47 +1,235 @@
+import asyncio
+import json
+import logging
 import os
+import time
 import httpx
+from metrics import observe_gemini_call, observe_gemini_sizes
+from resilience import Resilience
 
-async def generate_story(prompt: str = "", genre: str = "fantasy", is_continuation: bool = False) -> dict:
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not set")
+logger = logging.getLogger(__name__)
 
-    url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
-    headers = {"Content-Type": "application/json"}
-    params = {"key": api_key}
+GEMINI_URL = os.environ.get(
+    "GEMINI_URL",
+    "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent",
+)
+GEMINI_STREAM_URL = os.environ.get("GEMINI_STREAM_URL", GEMINI_URL.replace(":generateContent", ":streamGenerateContent"))
+# Upper bound on simultaneous Gemini calls per worker; extra calls wait for a free slot
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", 10))
+GEMINI_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", 60))
+
+FALLBACK_CHOICES = [
+    "She takes a step forward.",
+    "She turns back to reconsider.",
+    "She calls out for help."
+]
+
+# context is the story so far (see story_context.build_context) for continuations and endings
+def build_prompt(prompt: str = "", genre: str = "fantasy", is_continuation: bool = False, context: str = None) -> str:
     base_prompt = f"Write a short {genre} story" + (f" based on this prompt: {prompt}" if prompt else "") + "."
+    if context:
+        base_prompt += f"\n\n{context}\n\n"
     if is_continuation:
         instruction = f" Continue the {genre} story from the previous part ending with '{prompt}'. Do not repeat the previous part verbatim."
     else:
         instruction = " Format the story in 2-3 short paragraphs for readability."
-    data = {
-        "contents": [
-            {
-                "parts": [
-                    {
-                        "text": f"{base_prompt}{instruction} End the story with three distinct, relevant choice options for the next part. "
-                                f"Each choice should be a full sentence describing an action, scenario, item, or decision "
-                                f"that continues the narrative naturally (e.g., 'She draws her sword to fight the beast,' "
-                                f"'She searches the cave for a hidden exit,' 'She offers the gem to the stranger'). "
-                                f"Do not use labels like 'Choice 1' or ask questions in the story or choices."
-                    }
-                ]
-            }
-        ]
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, headers=headers, params=params, json=data)
-        response.raise_for_status()
-        result = response.json()
-        story_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "No story generated.")
-    
+    return (f"{base_prompt}{instruction} End the story with three distinct, relevant choice options for the next part. "
+            f"Each choice should be a full sentence describing an action, scenario, item, or decision "
+            f"that continues the narrative naturally (e.g., 'She draws her sword to fight the beast,' "
+            f"'She searches the cave for a hidden exit,' 'She offers the gem to the stranger'). "
+            f"Do not use labels like 'Choice 1' or ask questions in the story or choices.")
+
+def build_summary_prompt(summary: str, new_text: str, genre: str, max_words: int) -> str:
+    earlier = f"Summary of the story so far:\n{summary}\n\n" if summary else ""
+    return (f"{earlier}Next part of the {genre} story:\n{new_text}\n\n"
+            f"Rewrite the summary so it also covers the next part, in at most {max_words} words. "
+            f"Keep the characters, places, items and unresolved threads a writer would need to continue the story. "
+            f"Reply with the summary only.")
+
+def parse_story(story_text: str) -> dict:
     lines = [line.strip() for line in story_text.split("\n") if line.strip()]
-    choices = lines[-3:] if len(lines) >= 3 else [
-        "She takes a step forward.",
-        "She turns back to reconsider.",
-        "She calls out for help."
-    ]
+    choices = lines[-3:] if len(lines) >= 3 else list(FALLBACK_CHOICES)
     story_body = "\n\n".join(lines[:-3]) if len(lines) > 3 else story_text
-    
-    return {"story": story_body, "choices": choices}
\ No newline at end of file
+    return {"story": story_body, "choices": choices}
+
+# Long-lived Gemini client shared by every request in this worker. Connections are pooled
+# (HTTP/2 when h2 is installed) so only the first call pays for the TCP/TLS handshake.
+class StoryGenerator:
+    def __init__(self, url: str = GEMINI_URL, max_concurrency: int = GEMINI_MAX_CONCURRENCY, timeout: float = GEMINI_TIMEOUT,
+                 stream_url: str = None, resilience: Resilience = None):
+        self.url = url
+        self.stream_url = stream_url or url.replace(":generateContent", ":streamGenerateContent")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._client = None
+        self._semaphore = None
+        self.resilience = resilience or Resilience()
+        # Per call kind ("story", "continuation", "ending", "summary"): calls and prompt tokens reported by Gemini
+        self.usage = {}
+
+    async def start(self):
+        if self._client is not None:
+            return
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+                keepalive_expiry=60,
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+        self._client = None
+        self._semaphore = None
+
+    async def _prepare(self):
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not set")
+        # Scripts and one-off callers may not have gone through app startup
+        if self._client is None:
+            await self.start()
+        return api_key
+
+    def record_usage(self, kind: str, prompt_text: str, response_chars: int, usage: dict):
+        # Fall back to the usual ~4 characters per token if Gemini left usageMetadata out
+        prompt_tokens = usage.get("promptTokenCount") or len(prompt_text) // 4
+        observe_gemini_sizes(kind, len(prompt_text), response_chars, prompt_tokens)
+        totals = self.usage.setdefault(kind, {"calls": 0, "prompt_tokens": 0, "last_prompt_tokens": 0, "max_prompt_tokens": 0})
+        totals["calls"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["last_prompt_tokens"] = prompt_tokens
+        totals["max_prompt_tokens"] = max(totals["max_prompt_tokens"], prompt_tokens)
+        logger.debug(f"Gemini {kind} call: {prompt_tokens} prompt tokens")
+
+    # Sends a ready-made prompt and returns the text of the first candidate, under the kind's
+    # deadlines, retries, hedging and circuit breaker (see resilience.py)
+    async def complete(self, prompt_text: str, kind: str = "story") -> str:
+        api_key = await self._prepare()
+        headers = {"Content-Type": "application/json"}
+        params = {"key": api_key}
+        data = {"contents": [{"parts": [{"text": prompt_text}]}]}
+
+        async def attempt(timeout: float):
+            started = time.perf_counter()
+            try:
+                response = await self._client.post(self.url, headers=headers, params=params, json=data, timeout=timeout)
+                response.raise_for_status()
+            except Exception as e:
+                observe_gemini_call(kind, time.perf_counter() - started, e)
+                raise
+            observe_gemini_call(kind, time.perf_counter() - started)
+            return response.json()
+
+        # The wait for a free connection is kept out of each attempt's timeout
+        result = await self.resilience.call(kind, attempt, self._semaphore)
+        text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "No story generated.")
+        self.record_usage(kind, prompt_text, len(text), result.get("usageMetadata", {}))
+        return text
+
+    # kind defaults to "continuation" or "story"; endings pass "ending" so they get their own policy
+    async def generate(self, prompt: str = "", genre: str = "fantasy", is_continuation: bool = False, context: str = None, kind: str = None) -> dict:
+        kind = kind or ("continuation" if is_continuation else "story")
+        return parse_story(await self.complete(build_prompt(prompt, genre, is_continuation, context), kind))
+
+    # Yields text chunks as Gemini produces them (server-sent events from streamGenerateContent).
+    # Callers join the chunks and run parse_story on the result once the stream ends.
+    # Streams are never hedged, and are only retried until the first chunk has been yielded.
+    async def stream(self, prompt: str = "", genre: str = "fantasy", is_continuation: bool = False, context: str = None, kind: str = None):
+        api_key = await self._prepare()
+        prompt_text = build_prompt(prompt, genre, is_continuation, context)
+        kind = kind or ("continuation" if is_continuation else "story")
+        policy = self.resilience.policy(kind)
+        probe = self.resilience.admit()
+        deadline = time.monotonic() + policy.total_timeout
+        try:
+            for number in range(policy.retries + 1):
+                sent = False
+                chunks = self._stream_attempt(api_key, prompt_text, kind, policy, deadline)
+                try:
+                    async for text in chunks:
+                        sent = True
+                        yield text
+                    return
+                except Exception as e:
+                    # The reader has already seen the text, so it can't be swapped for another attempt's
+                    if sent:
+                        raise
+                    await asyncio.sleep(self.resilience.retry_delay(e, number, policy, deadline))
+                finally:
+                    # Frees the connection and semaphore slot even if our caller stops early
+                    await chunks.aclose()
+        finally:
+            if probe:
+                self.resilience.breaker.end_probe()
+
+    async def _stream_attempt(self, api_key: str, prompt_text: str, kind: str, policy, deadline: float):
+        headers = {"Content-Type": "application/json"}
+        params = {"key": api_key, "alt": "sse"}
+        data = {"contents": [{"parts": [{"text": prompt_text}]}]}
+        usage, response_chars = {}, 0
+
+        # The wait for a free connection is not part of the attempt, so it is not timed
+        await self.resilience.acquire_slot(self._semaphore, deadline)
+        self.resilience.stats["attempts"] += 1
+        try:
+            started = time.perf_counter()
+            try:
+                # Bounds the wait for the response headers, i.e. the time to first chunk, the same way
+                timeout = self.resilience.time_left(policy, deadline)
+                async with self._client.stream("POST", self.stream_url, headers=headers, params=params, json=data, timeout=timeout) as response:
+                    response.raise_for_status()
+                    lines = response.aiter_lines()
+                    while True:
+                        # The attempt timeout bounds the wait for each chunk, the deadline the whole stream
+                        try:
+                            line = await asyncio.wait_for(lines.__anext__(), self.resilience.time_left(policy, deadline))
+                        except StopAsyncIteration:
+                            break
+                        if not line.startswith("data:"):
+                            continue
+                        event = json.loads(line[len("data:"):])
+                        # Sent with every chunk; the last one has the final counts
+                        usage = event.get("usageMetadata", usage)
+                        for candidate in event.get("candidates", [])[:1]:
+                            for part in candidate.get("content", {}).get("parts", []):
+                                if part.get("text"):
+                                    response_chars += len(part["text"])
+                                    yield part["text"]
+            except Exception as e:
+                observe_gemini_call(kind, time.perf_counter() - started, e)
+                self.resilience.attempt_failed(e)
+                raise
+        finally:
+            self._semaphore.release()
+        observe_gemini_call(kind, time.perf_counter() - started)
+        self.resilience.attempt_succeeded(kind)
+        self.record_usage(kind, prompt_text, response_chars, usage)
+
+    async def generate_many(self, requests: list) -> list:
+        # Each request is a (prompt, genre, is_continuation) tuple; calls run concurrently
+        return await asyncio.gather(*(self.generate(*request) for request in requests))
+
+generator = StoryGenerator(stream_url=GEMINI_STREAM_URL)
+
+async def generate_story(prompt: str = "", genre: str = "fantasy", is_continuation: bool = False, context: str = None, kind: str = None) -> dict:
+    return await generator.generate(prompt, genre, is_continuation, context, kind)
+
+async def generate_stories(prompt: str = "", genre: str = "fantasy", count: int = 3) -> list:
+    return await generator.generate_many([(prompt, genre, False)] * count)
+
+def stream_story(prompt: str = "", genre: str = "fantasy", is_continuation: bool = False, context: str = None):
+    return generator.stream(prompt, genre, is_continuation, context)
+
+async def summarize_story(summary: str, new_text: str, genre: str, max_words: int) -> str:
+    return (await generator.complete(build_summary_prompt(summary, new_text, genre, max_words), "summary")).strip()
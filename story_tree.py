@@ -0,0 +1,52 @@
+from sqlalchemy import select, func, literal
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import StoryPart, ChoiceOption
+
+# A story is a tree: every part points at the part before it (previous_part_id) and each
+# taken choice at the part it led to (next_part_id). Story.head_part_id marks the part the
+# reader is on; the active path is the chain of parts from the root down to it.
+
+# Recursive CTE of (id, previous_part_id, depth) from head up to the root, head at depth 0.
+# head can be a part id or a scalar subquery. Each step is a primary key lookup. A part is
+# always newer than the part before it, so min_id can cut the walk short, as can max_depth.
+def path_cte(head, name: str = "story_path", min_id: int = None, max_depth: int = None):
+    path = select(StoryPart.id, StoryPart.previous_part_id, literal(0).label("depth")).where(StoryPart.id == head).cte(name, recursive=True)
+    parent = aliased(StoryPart)
+    step = select(parent.id, parent.previous_part_id, path.c.depth + 1).join(path, parent.id == path.c.previous_part_id)
+    if min_id is not None:
+        step = step.where(parent.id >= min_id)
+    if max_depth is not None:
+        step = step.where(path.c.depth < max_depth)
+    return path.union_all(step)
+
+# (part id, part text, text of the choice that led to it) from the root down to head, in one query
+def path_parts_query(head):
+    path = path_cte(head)
+    return (
+        select(StoryPart.id, StoryPart.text, ChoiceOption.text)
+        .join(path, path.c.id == StoryPart.id)
+        .outerjoin(ChoiceOption, ChoiceOption.next_part_id == StoryPart.id)
+        .order_by(path.c.depth.desc())
+    )
+
+# Every choice offered along the path to head, taken or not, for the branch selector
+async def path_choices(db: AsyncSession, head_part_id: int) -> dict:
+    path = path_cte(head_part_id)
+    choices = (await db.execute(
+        select(ChoiceOption.story_part_id, ChoiceOption.id, ChoiceOption.text, ChoiceOption.next_part_id)
+        .where(ChoiceOption.story_part_id.in_(select(path.c.id)))
+        .order_by(ChoiceOption.id)
+    )).all()
+    by_part = {}
+    for choice in choices:
+        by_part.setdefault(choice.story_part_id, []).append(choice)
+    return by_part
+
+# Where a branch was left off: the newest part written below part_id (or part_id itself).
+# Walks down the tree through the previous_part_id index.
+async def branch_tip(db: AsyncSession, part_id: int) -> int:
+    below = select(StoryPart.id).where(StoryPart.id == part_id).cte("branch", recursive=True)
+    child = aliased(StoryPart)
+    below = below.union_all(select(child.id).join(below, child.previous_part_id == below.c.id))
+    return (await db.execute(select(func.max(below.c.id)))).scalar()
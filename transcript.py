@@ -0,0 +1,81 @@
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Story, StoryPart, ChoiceOption, StoryTranscript
+from story_tree import path_parts_query
+
+# Renders the path from the first part down to head: returns the text and the path's part ids
+async def render_path(db: AsyncSession, head) -> tuple:
+    rows = (await db.execute(path_parts_query(head))).all()
+    story_text = [text if i == 0 else render_step(text, chosen) for i, (_, text, chosen) in enumerate(rows)]
+    return "".join(story_text), [part_id for part_id, _, _ in rows]
+
+# Rebuilds a transcript from its parts in two queries regardless of story length: the path
+# to the story's head (one recursive CTE) and the open choices of the head.
+async def load_transcript(db: AsyncSession, story_id: int) -> dict:
+    text, part_ids = await render_path(db, select(Story.head_part_id).where(Story.id == story_id).scalar_subquery())
+    current_part_id = part_ids[-1] if part_ids else None
+    choices = (await db.execute(select(ChoiceOption).where(ChoiceOption.story_part_id == current_part_id).order_by(ChoiceOption.id))).scalars().all() if part_ids else []
+    return {
+        "story": text,
+        "choices": [(choice.text, choice.id) for choice in choices],
+        # Not yet continued; after a rewind the head may also offer choices taken before
+        "open_choice_ids": [choice.id for choice in choices if choice.next_part_id is None],
+        "current_part_id": current_part_id,
+    }
+
+def render_step(text: str, chosen_text: str = None) -> str:
+    if chosen_text:
+        return f"\n\n<span class='chosen'>{chosen_text}</span>\n\n{text}"
+    return f"\n\n{text}"
+
+def start_transcript(db: AsyncSession, story_id: int, part: StoryPart):
+    db.add(StoryTranscript(story_id=story_id, text=part.text, last_part_id=part.id))
+
+# Moves the head to a part just written below it. Appends in SQL so the stored text is never
+# read back into Python, unless the head moved elsewhere meanwhile and the path is rebuilt.
+# A story without a transcript row yet is simply rebuilt from its parts on the next read.
+async def advance_head(db: AsyncSession, story_id: int, part: StoryPart, chosen_text: str = None):
+    await db.execute(update(Story).where(Story.id == story_id).values(head_part_id=part.id))
+    appended = await db.execute(
+        update(StoryTranscript)
+        .where(StoryTranscript.story_id == story_id, StoryTranscript.last_part_id == part.previous_part_id)
+        .values(text=StoryTranscript.text + render_step(part.text, chosen_text), last_part_id=part.id)
+    )
+    if appended.rowcount != 1:
+        await rebuild_transcript(db, story_id, part.id)
+
+# Moves the head to any part of the story, e.g. back to an earlier one to take another choice
+async def move_head(db: AsyncSession, story_id: int, part_id: int):
+    await db.execute(update(Story).where(Story.id == story_id).values(head_part_id=part_id))
+    await rebuild_transcript(db, story_id, part_id)
+
+# The rolling summary only stays if the part it covers up to is still on the path
+async def rebuild_transcript(db: AsyncSession, story_id: int, head_part_id: int):
+    text, part_ids = await render_path(db, head_part_id)
+    summary_part_id = (await db.execute(select(StoryTranscript.summary_part_id).where(StoryTranscript.story_id == story_id))).scalar()
+    values = {"text": text, "last_part_id": head_part_id}
+    if summary_part_id is not None and summary_part_id not in part_ids:
+        values.update(summary=None, summary_part_id=None)
+    await db.execute(update(StoryTranscript).where(StoryTranscript.story_id == story_id).values(**values))
+
+# Page read path: one row for the text plus one query for the open choices
+async def get_transcript(db: AsyncSession, story_id: int) -> dict:
+    cached = await db.get(StoryTranscript, story_id)
+    if cached is None:
+        transcript = await load_transcript(db, story_id)
+        if transcript["current_part_id"] is not None:
+            db.add(StoryTranscript(story_id=story_id, text=transcript["story"], last_part_id=transcript["current_part_id"]))
+            try:
+                await db.commit()
+            except IntegrityError:
+                # Another request backfilled the same story first
+                await db.rollback()
+        return transcript
+    choices = (await db.execute(select(ChoiceOption).where(ChoiceOption.story_part_id == cached.last_part_id).order_by(ChoiceOption.id))).scalars().all()
+    return {
+        "story": cached.text,
+        "choices": [(choice.text, choice.id) for choice in choices],
+        "open_choice_ids": [choice.id for choice in choices if choice.next_part_id is None],
+        "current_part_id": cached.last_part_id,
+    }
@@ -0,0 +1,56 @@
+import os
+import time
+from collections import OrderedDict
+from sqlalchemy.orm import make_transient_to_detached
+from models import User
+
+# Signed-in users by auth token, so a page view doesn't have to decode the JWT and load the
+# user row again. Entries live in this worker's memory only: UserManager invalidates them when
+# a user changes here, and the short TTL bounds how stale they can be after a change made by
+# another worker.
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 30))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 4096))
+
+USER_COLUMNS = [column.key for column in User.__table__.columns]
+
+class UserCache:
+    def __init__(self, ttl: int = USER_CACHE_TTL, max_entries: int = USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    # Returns a new detached User each time, so a request can't change the cached snapshot.
+    # Detached rather than transient: adding it to a session updates the row instead of inserting.
+    def get(self, token: str):
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        if entry["expires_at"] < time.monotonic():
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        user = User(**entry["user"])
+        make_transient_to_detached(user)
+        return user
+
+    # expires_in caps the entry's lifetime, e.g. at the seconds left before the token expires
+    def put(self, token: str, user: User, expires_in: float = None):
+        ttl = self.ttl if expires_in is None else min(self.ttl, expires_in)
+        if ttl <= 0:
+            return
+        self._entries[token] = {
+            "user": {key: getattr(user, key) for key in USER_COLUMNS},
+            "expires_at": time.monotonic() + ttl,
+        }
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        for token in [token for token, entry in self._entries.items() if entry["user"]["id"] == user_id]:
+            del self._entries[token]
+
+    def __len__(self):
+        return len(self._entries)
+
+user_cache = UserCache()